@@ -22,7 +22,8 @@ The acceptable regions in the database are:
 We interface with the SQLite database 'test.db' using a context manager. A list
 of teams is generated by querying the database using the 'regions' filter. For 
 each team returned the team name and number of runners are printed to the 
-screen.
+screen.  Only names and counts are needed, so the runners are counted by the
+database with the fastread module instead of being loaded as Runner objects.
 
 If no results are found, the program raises an error and prints the 
 acceptable region filter options.
@@ -31,6 +32,7 @@ acceptable region filter options.
 
 import argparse
 import NIRCAdb as ndb
+from NIRCAdb import fastread as ndbfastread
 from sqlalchemy import exc
 
 ################################################################################
@@ -42,18 +44,18 @@ from sqlalchemy import exc
 def main(region):
 
     ## Use the context manager to interface with the database
-    with ndb.db_session('sqlite:///test.db') as f:
+    with ndb.db_session('sqlite:///test.db', readonly=True) as f:
 
         try:
 
-            ## Query the database for teams using the region filter
-            team_list = ndb.Team.from_db(f, regions=region)
+            ## Query the database for team sizes using the region filter
+            team_sizes = ndbfastread.team_sizes(f, regions=region,
+                                                output='records')
             print "Region: {0}\n".format(region)
 
-            ## Print out team attributes Team.name and Team.size()
-            for team in team_list:
-                print 'Team: {0}\nRunners: {1}'.format(team.name,
-                                                         team.size())
+            ## Print out the team name and number of runners
+            for team in team_sizes:
+                print 'Team: {0}\nRunners: {1}'.format(team.team, team.size)
 
             return True
 
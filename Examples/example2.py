@@ -33,7 +33,7 @@ from sqlalchemy import exc
 
 def main(team_name):
 
-    with ndb.db_session('sqlite:///test.db') as f:
+    with ndb.db_session('sqlite:///test.db', readonly=True) as f:
     
         try:
             ## Query the database for the specific team using the name filter.
@@ -30,7 +30,7 @@ from NIRCAdb.search import runner_search
 
 def main(runner_name):
 
-    with ndb.db_session('sqlite:///test.db') as f:
+    with ndb.db_session('sqlite:///test.db', readonly=True) as f:
 
         ## Search the database for runners and return 5 search results.
         ## The results are a list of tuples (runner, ratio).
@@ -69,8 +69,15 @@ from database import Runner
 from database import Team
 from database import Result
 from database import Race
+from database import RatingHistory
+from database import TeamAlias
+from database import RunnerAlias
 from database import REGIONS
+from database import SCALES
 from database import db_session
+from database import get_engine
+from database import get_session_registry
+from cache import query_cache
 
 __version__ = "7.0rc2"
 
@@ -0,0 +1,176 @@
+"""Query result cache for use with NIRCAdb Package.
+
+This contains the least recently used cache behind the cached queries of
+Runner.from_db() and Team.from_db().  Results are loaded with a separate
+session and detached from it, so they can be shared between callers and
+sessions.  They are read-only: modifying a cached object would change the
+result of every later call with the same filters.
+
+The cache is cleared whenever a session flushes changes to a watched class,
+runs a bulk update or delete on one, or reports a change made by a statement
+executed directly.  Changes made by other processes are not detected.
+
+"""
+
+################################################################################
+##
+## Modules and Packages
+##
+################################################################################
+
+import collections
+import itertools
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+################################################################################
+##
+## Query Cache Object
+##
+################################################################################
+
+class QueryCache:
+    """Represents a least recently used cache of query results.
+
+    Attributes:
+        maxsize (int): Maximum number of cached queries.
+        hits (int): Number of queries answered from the cache.
+        misses (int): Number of queries loaded from the database.
+        invalidations (int): Number of times the cache was cleared by a
+            change to a watched class.
+    """
+
+    def __init__(self, maxsize=128):
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._entries = collections.OrderedDict()
+        self._classes = ()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def watch(self, *classes):
+        """Clear the cache when instances of the given classes change.
+
+        Args:
+            *classes: Mapped classes whose changes invalidate the cache.
+        """
+
+        if len(self._classes) == 0:
+            event.listen(Session, 'after_flush', self._after_flush)
+            event.listen(Session, 'after_commit', self._after_commit)
+            event.listen(Session, 'after_bulk_update', self._after_bulk)
+            event.listen(Session, 'after_bulk_delete', self._after_bulk)
+
+        self._classes += classes
+
+    def get(self, session, key, load):
+        """Return the cached result of a query, loading it on a miss.
+
+        Args:
+            session (Session): Database session object.  Only its bind is
+                used, the result is loaded with a separate session.
+            key (tuple): Hashable description of the query.
+            load (callable): Function of a session returning the result as a
+                list.
+
+        Returns:
+            New list of the cached, detached objects.
+        """
+
+        bind = session.get_bind()
+
+        ## In-memory databases are private to their engine
+        database = bind.url.database
+        if database in [None, '', ':memory:']:
+            return load(session)
+
+        key = (database,) + key
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                value = self._entries.pop(key)
+                self._entries[key] = value
+                return list(value)
+            self.misses += 1
+            generation = self._generation
+
+        ## Closing the session detaches the loaded objects without expiring
+        load_session = Session(bind=bind, autoflush=False)
+        try:
+            value = load(load_session)
+        finally:
+            load_session.close()
+
+        ## Skip storing a result that was invalidated while it was loaded
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = value
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+        return list(value)
+
+    def clear(self):
+        """Remove every cached result."""
+
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def changed(self, session):
+        """Clear the cache after a session changed data outside the ORM.
+
+        Statements executed directly are not seen by the flush events, so
+        code that writes to a watched table that way reports it here.
+
+        Args:
+            session (Session): Database session that made the change.
+        """
+
+        session.info['query_cache_changed'] = True
+        self._invalidate()
+
+    def info(self):
+        """Return a dictionary of the cache statistics."""
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations,
+                    'maxsize': self.maxsize, 'size': len(self._entries)}
+
+    def _invalidate(self):
+
+        self.clear()
+        with self._lock:
+            self.invalidations += 1
+
+    def _after_flush(self, session, flush_context):
+
+        ## Pending changes are still listed while after_flush runs
+        for obj in itertools.chain(session.new, session.dirty,
+                                   session.deleted):
+            if isinstance(obj, self._classes):
+                session.info['query_cache_changed'] = True
+                self._invalidate()
+                return
+
+    def _after_commit(self, session):
+
+        ## Clear again, in case a result was cached before the commit
+        if session.info.pop('query_cache_changed', False):
+            self._invalidate()
+
+    def _after_bulk(self, update_context):
+
+        mapper = getattr(update_context, 'mapper', None)
+        if mapper is None or issubclass(mapper.class_, self._classes):
+            self.changed(update_context.session)
+
+## Cache shared by the cached queries of the package
+query_cache = QueryCache()
@@ -1,6 +1,6 @@
 """Database objects for use with the NIRCAdb Package.
 
-This contains the database entry Objects Runner, Team and Results, that 
+This contains the database entry Objects Runner, Team, Result and Race, that 
 interface with the NIRCA database.  In addition a context manager is provided
 to allow easy database session use.
 
@@ -11,6 +11,9 @@ __version__ = "7.0rc2"
 REGIONS = ['Great Lakes', 'Great Plains', 'Heartland', 'Mid-Atlantic',
            'Northeast', 'Pacific', 'Southeast']
 
+## Seconds per Speed Rating point for each race distance (meters)
+SCALES = {8000: 5.0, 6000: 3.75, 5000: 3.0, 4000: 2.5}
+
 ################################################################################
 ##
 ## Modules and Packages
@@ -19,38 +22,492 @@ REGIONS = ['Great Lakes', 'Great Plains', 'Heartland', 'Mid-Atlantic',
 
 import sqlalchemy as sql
 import numpy as np
+import collections
 import datetime
+import itertools
+import sqlite3
+import threading
 
+from sqlalchemy import event
+from sqlalchemy.ext import baked
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref, sessionmaker, reconstructor
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.pool import StaticPool
 from scipy import stats
 from contextlib import contextmanager
 
-from errors import QueryError
+from errors import QueryError, WriteBackError
+from cache import query_cache
+from names import name_key, phonetic_key
+
+import migrations
 
 Base = declarative_base()
-Session = sessionmaker()
+
+## Pragmas set on every new SQLite connection
+SQLITE_PRAGMAS = [('journal_mode', 'WAL'),
+                  ('synchronous', 'NORMAL'),
+                  ('cache_size', -65536),
+                  ('mmap_size', 268435456),
+                  ('temp_store', 'MEMORY')]
+
+## Largest number of values bound to a single statement, 32766 since SQLite
+## 3.32 and 999 before
+if sqlite3.sqlite_version_info >= (3, 32, 0):
+    HOST_PARAMETER_LIMIT = 32766
+else:
+    HOST_PARAMETER_LIMIT = 999
+
+## Largest number of values bound to a single IN clause.  Two full chunks
+## stay below the host parameter limit, so lists are only split when one
+## statement cannot hold them
+if sqlite3.sqlite_version_info >= (3, 32, 0):
+    IN_CHUNK_SIZE = 16000
+else:
+    IN_CHUNK_SIZE = 256
+
+## Compiled queries for the filter combinations of the from_db() methods
+_bakery = baked.bakery()
+
+## Engines and session registries created so far, keyed by database URL
+## and read-only flag
+_engines = dict()
+_registries = dict()
+_lock = threading.RLock()
+
+def time_in_seconds(time):
+    """Convert a race time in HH:MM:SS.ms format to seconds."""
+
+    return sum(float(x) * 60 ** i for i,x in \
+               enumerate(reversed(time.split(":"))))
+
+def get_engine(database, readonly=False):
+    """Return the engine for a database, creating it on first use.
+
+    Engines are cached per database URL, so the schema is created and 
+    migrated only once per process.  SQLite connections are configured
+    with SQLITE_PRAGMAS when they are opened.
+
+    Read-only engines never create or migrate the schema, so the database
+    must already be up to date, e.g. by Utils/migrate_database.py.  Their 
+    SQLite connections have query_only set, which is what keeps them from
+    writing: writes raise an error instead of taking the write lock.
+
+    Args:
+        database (str): Database filepath.
+        readonly (bool, optional): True for a read-only engine. Defaults to
+            False.
+
+    Returns:
+        Engine bound to the database.
+    """
+
+    with _lock:
+        engine = _engines.get((database, readonly))
+        if engine is None:
+            if readonly:
+                engine = _create_readonly_engine(database)
+            else:
+                engine = sql.create_engine(database, echo=False)
+                if engine.dialect.name == 'sqlite':
+                    event.listen(engine, 'connect', _set_sqlite_pragmas)
+                Base.metadata.create_all(engine)
+                migrations.upgrade(engine)
+            _engines[(database, readonly)] = engine
+
+    return engine
+
+def _create_readonly_engine(database):
+    """Create an engine that cannot modify the database."""
+
+    engine = sql.create_engine(database, echo=False)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _set_sqlite_readonly_pragmas)
+
+    return engine
+
+def get_session_registry(database, readonly=False):
+    """Return the thread-local session registry for a database.
+
+    Each database URL has its own sessionmaker, so sessions are never bound
+    to another database by a concurrent call.  Calling the registry returns
+    the session of the current thread; registry.remove() closes it.
+
+    Args:
+        database (str): Database filepath.
+        readonly (bool, optional): True for read-only sessions. Defaults to
+            False.
+
+    Returns:
+        scoped_session bound to the database.
+    """
+
+    engine = get_engine(database, readonly)
+
+    with _lock:
+        registry = _registries.get((database, readonly))
+        if registry is None:
+            registry = scoped_session(sessionmaker(bind=engine,
+                                                   autoflush=not readonly))
+            _registries[(database, readonly)] = registry
+
+    return registry
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply SQLITE_PRAGMAS to a new SQLite connection."""
+
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS:
+        cursor.execute('PRAGMA {0} = {1}'.format(pragma, value))
+    cursor.close()
+
+def _set_sqlite_readonly_pragmas(dbapi_connection, connection_record):
+    """Apply SQLITE_PRAGMAS to a new read-only SQLite connection.
+
+    The journal mode is left alone, since changing it is a write.
+    """
+
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS:
+        if pragma != 'journal_mode':
+            cursor.execute('PRAGMA {0} = {1}'.format(pragma, value))
+    cursor.execute('PRAGMA query_only = ON')
+    cursor.close()
+
+def _chunks(values):
+    """Split a filter list into chunks small enough for one IN clause.
+
+    Values are deduplicated.  List filters use expanding bind parameters,
+    so the compiled statement is reused whatever the chunk length.
+
+    Returns:
+        List of chunks, with a single chunk for lists of at most one value.
+    """
+
+    values = list(set(values))
+    if len(values) <= 1:
+        return [values]
+
+    return [values[i:i + IN_CHUNK_SIZE] for i in \
+            range(0, len(values), IN_CHUNK_SIZE)]
+
+def _chunk_product(*lists):
+    """Yield every combination of the chunks of several filter lists."""
+
+    return itertools.product(*[_chunks(values) for values in lists])
+
+def _list_filter(column, values, key, params):
+    """Return a filter of a column by a list of values, or None if empty.
+
+    The values are bound to the parameter 'key', added to 'params'.  An 
+    expanding parameter is used for several values, so the compiled query
+    does not depend on the length of the list.
+    """
+
+    if len(values) == 0:
+        return None
+
+    if len(values) == 1:
+        params[key] = values[0]
+        return column == sql.bindparam(key)
+    else:
+        params[key] = values
+        return column.in_(sql.bindparam(key, expanding=True))
+
+def _rank_runners(statement):
+    """Rank the rated runners selected by a statement within their team.
+
+    Runners are numbered by a ROW_NUMBER() window over each team, ordered by
+    rating, so the n highest rated runners of every team are those with 
+    rank <= n.  Runners without a team or a Speed Rating are not ranked.
+
+    Args:
+        statement (Select): Select of runner columns, with any filters.
+
+    Returns:
+        Subquery 'ranked' of the statement columns and a 'rank' column.
+    """
+
+    rank = sql.func.row_number().over(
+        partition_by=Runner.team_id,
+        order_by=[Runner.rating.desc(), Runner.id]).label('rank')
+
+    return statement.column(rank).\
+           where(Runner.team_id != None).\
+           where(Runner.rating != None).\
+           alias('ranked')
+
+def _iter_pages(session, query, params, column, batch_size):
+    """Yield the results of a baked query in pages of at most batch_size.
+
+    Pages are selected by keyset pagination on a unique indexed column, so
+    every page is a cheap index range scan no matter how deep into the
+    results it is, and the eager loading options of the query apply per 
+    page.
+    """
+
+    params = dict(params, batch_size=batch_size)
+    first = query.with_criteria(
+        lambda q: q.order_by(column).limit(sql.bindparam('batch_size')),
+        column)
+    after = query.with_criteria(
+        lambda q: q.filter(column > sql.bindparam('last')).\
+                  order_by(column).limit(sql.bindparam('batch_size')),
+        column)
+
+    page = first(session).params(**params).all()
+    while len(page) > 0:
+        yield page
+        if len(page) < batch_size:
+            break
+        last = getattr(page[-1], column.key)
+        page = after(session).params(last=last, **params).all()
+
+def _key_value(value):
+    """Return a key value as it is read back from SQLite."""
+
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+def _upsert(session, cls, columns, key, update, rows):
+    """Insert rows into the table of a class, updating rows already in it.
+
+    Rows are written with INSERT ... ON CONFLICT on the unique 'key' 
+    columns, as many rows per statement as HOST_PARAMETER_LIMIT allows for
+    the number of columns.  Where SQLite supports RETURNING (3.35+) the ids
+    of updated rows are read back by the same statement, otherwise with one
+    SELECT per statement.  Objects of the class loaded in the session are
+    expired if their row was updated.
+
+    Args:
+        session (Session): Database session object.
+        cls (class): Mapped class of the table.
+        columns (list): Column names (str) of the row values.
+        key (list): Column names (str) of the unique key, all in 'columns'.
+        update (str): SET clause applied to rows already in the table, or
+            'None' to leave them unchanged.
+        rows (list): Row values as tuples.
+
+    Returns:
+        List of the row ids (int), in the order of the rows.
+    """
+
+    positions = [columns.index(column) for column in key]
+
+    def row_key(row):
+        return tuple(_key_value(row[i]) for i in positions)
+
+    ## Later rows with the same key replace earlier ones
+    unique = collections.OrderedDict((row_key(row), row) for row in rows)
+    values = unique.values()
+
+    ## Pending changes must be written before the statements see the table
+    session.flush()
+    connection = session.connection()
+
+    ## RETURNING skips rows left unchanged, so their ids are selected
+    if update is None:
+        conflict = 'DO NOTHING'
+        returning = False
+    else:
+        conflict = 'DO UPDATE SET {0}'.format(update)
+        returning = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+    insert = 'INSERT INTO {0} ({1}) VALUES {{0}} ON CONFLICT ({2}) {3}'.\
+             format(cls.__tablename__, ', '.join(columns), ', '.join(key),
+                    conflict)
+    select = 'SELECT id, {0} FROM {1} WHERE ({0}) IN (VALUES {{0}})'.\
+             format(', '.join(key), cls.__tablename__)
+
+    ## Every row binds one value per column
+    chunk_size = HOST_PARAMETER_LIMIT // len(columns)
+
+    ids = dict()
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i:i + chunk_size]
+        params = tuple(value for row in chunk for value in row)
+        placeholders = ', '.join(['({0})'.format(', '.join(
+            ['?']*len(columns)))]*len(chunk))
+
+        if returning:
+            result = connection.execute(
+                insert.format(placeholders) + \
+                ' RETURNING id, {0}'.format(', '.join(key)), params)
+        else:
+            connection.execute(insert.format(placeholders), params)
+            result = connection.execute(
+                select.format(', '.join(['({0})'.format(', '.join(
+                    ['?']*len(key)))]*len(chunk))),
+                tuple(row[j] for row in chunk for j in positions))
+
+        for row in result:
+            ids[tuple(row[1:])] = row[0]
+
+    ## Loaded objects would otherwise keep their old attribute values
+    for row_id in ids.itervalues():
+        obj = session.identity_map.get(identity_key(cls, row_id))
+        if obj is not None:
+            session.expire(obj)
+
+    if len(ids) > 0:
+        query_cache.changed(session)
+
+    return [ids[row_key(row)] for row in rows]
+
+def _team_ids(session, team_list):
+    """Return a dictionary mapping team names to their team ids.
+
+    Raises:
+        QueryError: If a team is not found.
+    """
+
+    team_list = list(set(team_list))
+    team_ids = dict()
+    for chunk in _chunks(team_list):
+        for team_id, team in session.query(Team.id, Team.name).\
+                             filter(Team.name.in_(chunk)):
+            team_ids[team] = team_id
+
+    missing = [team for team in team_list if _key_value(team) not in team_ids]
+    if len(missing) > 0:
+        raise QueryError('No teams found: {0}.'.format(
+            ', '.join(sorted(missing))))
+
+    return team_ids
+
+def _create_memory_engine(database):
+    """Create an engine bound to an in-memory copy of a SQLite database.
+
+    The database file stays attached to the in-memory connection as 'disk',
+    so the copy and the write-back run entirely inside SQLite.
+
+    Returns:
+        Tuple of the engine, its sqlite3 connection and the data version of
+        the database file when it was copied.
+    """
+
+    ## Bring the schema of the file up to date before copying it
+    get_engine(database)
+    filename = sql.engine.url.make_url(database).database
+
+    connection = sqlite3.connect(':memory:', check_same_thread=False)
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None
+
+    cursor = connection.cursor()
+    cursor.execute('ATTACH DATABASE ? AS disk', (filename,))
+
+    ## Copy within one read transaction for a consistent snapshot, creating
+    ## indexes after the rows are inserted
+    cursor.execute('BEGIN')
+    schema = cursor.execute("SELECT type, name, sql FROM disk.sqlite_master "
+                            "WHERE sql IS NOT NULL "
+                            "AND name NOT LIKE 'sqlite_%' "
+                            "ORDER BY type != 'table'").fetchall()
+    for kind, name, statement in schema:
+        cursor.execute(statement)
+        if kind == 'table':
+            cursor.execute('INSERT INTO main."{0}" SELECT * FROM disk."{0}"'.\
+                           format(name))
+    version = cursor.execute('PRAGMA disk.user_version').fetchone()[0]
+    cursor.execute('PRAGMA main.user_version = {0:d}'.format(version))
+    data_version = cursor.execute('PRAGMA disk.data_version').fetchone()[0]
+    cursor.execute('COMMIT')
+    cursor.close()
+
+    connection.isolation_level = isolation_level
+    engine = sql.create_engine('sqlite://', creator=lambda: connection,
+                               poolclass=StaticPool, echo=False)
+
+    return engine, connection, data_version
+
+def _write_back(connection, data_version):
+    """Replace the contents of the attached database file in one transaction.
+
+    Raises:
+        WriteBackError: If the file was modified since it was copied.
+    """
+
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            ## Checked under the write lock, so no other write can slip in
+            if cursor.execute('PRAGMA disk.data_version').fetchone()[0] != \
+               data_version:
+                raise WriteBackError('Database was modified by another '
+                                     'connection; changes not written.')
+
+            tables = [row[0] for row in cursor.execute(
+                "SELECT name FROM main.sqlite_master WHERE type = 'table' "
+                "AND name NOT LIKE 'sqlite_%'").fetchall()]
+            for name in tables:
+                cursor.execute('DELETE FROM disk."{0}"'.format(name))
+                cursor.execute('INSERT INTO disk."{0}" '
+                               'SELECT * FROM main."{0}"'.format(name))
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+        cursor.close()
+    finally:
+        connection.isolation_level = isolation_level
 
 @contextmanager
-def db_session(database):
+def db_session(database, readonly=False, in_memory=False):
     """Create a session bound to the given database.
 
+    A read-only session cannot write and is rolled back instead of 
+    committed on exit, so many readers can run while another process holds
+    the write lock.  It does not create or migrate the schema.
+
+    An in-memory session works on a copy of a SQLite database held in 
+    memory, for batch jobs with many small reads and writes.  When the 
+    session exits without an error its changes are written back to the file
+    in a single transaction; otherwise the file is left untouched.
+
     Args:
         database (str): Database filepath.
+        readonly (bool, optional): True for a read-only session. Defaults
+            to False.
+        in_memory (bool, optional): True to work on an in-memory copy of
+            the database. Defaults to False.
+
+    Raises:
+        WriteBackError: If an in-memory session cannot write back because
+            the database file was modified by another connection.
     """
 
+    ## Independent session, so nested db_session calls do not share state
+    if in_memory:
+        engine, connection, data_version = _create_memory_engine(database)
+        session = sessionmaker(bind=engine, autoflush=not readonly)()
+    else:
+        session = get_session_registry(database, readonly).session_factory()
+
     try:
-        engine = sql.create_engine(database, echo=False)
-        Base.metadata.create_all(engine)
-        Session.configure(bind=engine)
-        session = Session()
         yield session
-        session.commit()
+        if readonly:
+            session.rollback()
+        else:
+            session.commit()
+            if in_memory:
+                _write_back(connection, data_version)
     except Exception as e:
         session.rollback()
         raise e
     finally:
         session.close()
+        if in_memory:
+            engine.dispose()
+            connection.close()
 
 ################################################################################
 ##
@@ -67,6 +524,8 @@ class Runner(Base):
         gender (str): Gender of runner.
         rating (float): Speed Rating for the runner.
         status (bool): True if runner is active, False if inactive.
+        name_key (str): Normalized name, set when the runner is written.
+        phonetic_key (str): Phonetic name, set when the runner is written.
         results (list): List of Result objects for the runner.
         average (float): Average of race results. Initialy 'None'.
         ratings_list (list): List of generated ratings. Initialy empty.
@@ -74,6 +533,10 @@ class Runner(Base):
     """
 
     __tablename__ = 'runners'
+    __table_args__ = (sql.Index('ix_runners_team_gender_status', 'team_id',
+                                'gender', 'status', 'rating'),
+                      sql.Index('ix_runners_team_name_gender', 'team_id',
+                                'name', 'gender', unique=True))
 
     ## Runner attributes stored in database
     id = sql.Column(sql.Integer, primary_key=True)
@@ -82,6 +545,8 @@ class Runner(Base):
     gender = sql.Column(sql.String)
     rating = sql.Column(sql.Float)
     status = sql.Column(sql.Boolean)
+    name_key = sql.Column(sql.String, index=True)
+    phonetic_key = sql.Column(sql.String, index=True)
 
     ## Create one-to-many relationship with Results table
     results = relationship("Result", backref=backref('runner'))
@@ -98,9 +563,13 @@ class Runner(Base):
         self._races_simulated = False
 
     @classmethod
-    def from_db(cls, session, names = [], team_list=[], gender=None, status=None):
+    def from_db(cls, session, names = [], team_list=[], gender=None, status=None,
+                load_team=False, load_results=False, cached=False):
         """Initialize Runner objects from database using a query.
 
+        Name and team lists longer than IN_CHUNK_SIZE are split into chunks
+        queried separately, so any number of values can be given.
+
         Args:
             session (Session): Database session object.
             names (list, optional): List of names (str) to filter by. Defaults 
@@ -109,14 +578,18 @@ class Runner(Base):
                 to empty list.
             gender (str, optional): Gender filter choice. Defaults to 'None'.
             status (bool, optional): Status filter choice. Defaults to 'None'.
+            load_team (bool, optional): Load each runner's team in the same
+                query. Defaults to False.
+            load_results (bool, optional): Load each runner's results with
+                one additional query. Defaults to False.
+            cached (bool, optional): Return detached, read-only Runner 
+                objects from the query cache. Defaults to False.
 
         Returns:
             Either a list of Runner objects, or a single Runner object, depending
             on results of the query.
         """
 
-        query = session.query(cls)
-
         ## Format runner names and team names as list
         if not isinstance(names, list):
             names = [names]
@@ -124,31 +597,114 @@ class Runner(Base):
         if not isinstance(team_list, list):
             team_list = [team_list]
 
+        if cached:
+            key = ('runners', tuple(names), tuple(team_list), gender, status,
+                   load_team, load_results)
+            return query_cache.get(session, key, lambda s: cls.from_db(
+                s, names, team_list, gender, status, load_team, load_results))
+
+        ## Long filter lists are queried in chunks
+        runners = []
+        for name_chunk, team_chunk in _chunk_product(names, team_list):
+            query, params = cls._query(name_chunk, team_chunk, gender, status,
+                                       load_team, load_results)
+            runners += query(session).params(**params).all()
+
+        ## Check that query returned non-empty list
+        if len(runners) == 0:
+            raise QueryError('No runners found.')
+        else:
+            return runners
+
+    @classmethod
+    def iter_from_db(cls, session, names=[], team_list=[], gender=None,
+                     status=None, load_team=False, load_results=False,
+                     batch_size=1000):
+        """Generate Runner objects from database, ordered by id.
+
+        Runners are loaded in pages of 'batch_size', so only the current 
+        page is held in memory by the generator.  Filters and eager loading
+        are the same as for from_db(); an empty query yields nothing.  Long
+        filter lists are queried in chunks, each ordered by id.
+
+        Args:
+            session (Session): Database session object.
+            names (list, optional): List of names (str) to filter by. Defaults 
+                to empty list.
+            team_list (list, optional): List of teams (str) to filter by. Defaults
+                to empty list.
+            gender (str, optional): Gender filter choice. Defaults to 'None'.
+            status (bool, optional): Status filter choice. Defaults to 'None'.
+            load_team (bool, optional): Load each runner's team in the same
+                query. Defaults to False.
+            load_results (bool, optional): Load each runner's results with
+                one additional query per page. Defaults to False.
+            batch_size (int, optional): Number of runners per page. Defaults
+                to 1000.
+
+        Yields:
+            Runner objects.
+        """
+
+        if not isinstance(names, list):
+            names = [names]
+        if not isinstance(team_list, list):
+            team_list = [team_list]
+
+        for name_chunk, team_chunk in _chunk_product(names, team_list):
+            query, params = cls._query(name_chunk, team_chunk, gender, status,
+                                       load_team, load_results)
+            for page in _iter_pages(session, query, params, cls.id,
+                                    batch_size):
+                for runner in page:
+                    yield runner
+
+    @classmethod
+    def _query(cls, names, team_list, gender, status, load_team,
+               load_results):
+        """Build the baked query used by from_db() and iter_from_db().
+
+        Criteria are only added for the filters in use, so each combination
+        of filters is compiled once and then reused with new parameters.
+
+        Returns:
+            Tuple of the BakedQuery and its parameters.
+        """
+
+        query = _bakery(lambda session: session.query(cls), cls)
+        params = dict()
+
         ## Filter by name
-        if len(names) == 1:
-            query = query.filter(cls.name == names[0])
-        elif len(names) > 1:
-            query = query.filter(cls.name.in_(names))
+        name_filter = _list_filter(cls.name, names, 'names', params)
+        if name_filter is not None:
+            query.add_criteria(lambda q: q.filter(name_filter),
+                               len(names) > 1)
         
         ## Filter by gender
         if gender in ['M', 'W']:
-            query = query.filter(cls.gender == gender)
+            query += lambda q: q.filter(cls.gender == sql.bindparam('gender'))
+            params['gender'] = gender
 
         ## Filter by status
         if status is not None:
-            query = query.filter(cls.status == status)
+            query += lambda q: q.filter(cls.status == sql.bindparam('status'))
+            params['status'] = status
 
-        if len(team_list) == 1:
-            query = query.join(Team).filter(Team.name == team_list[0])
-        elif len(team_list) > 1:
-            query = query.join(Team).filter(Team.name.in_(team_list))
+        team_filter = _list_filter(Team.name, team_list, 'team_list', params)
+        if team_filter is not None:
+            query.add_criteria(lambda q: q.join(Team).filter(team_filter),
+                               len(team_list) > 1)
 
-        ## Check that query returned non-empty list
-        runners = query.all()
-        if len(runners) == 0:
-            raise QueryError('No runners found.')
-        else:
-            return runners
+        ## Eager loading, reusing the team join if there is one
+        if load_team and len(team_list) > 0:
+            query += lambda q: q.options(contains_eager(cls.team))
+        elif load_team:
+            query += lambda q: q.options(joinedload(cls.team))
+
+        if load_results:
+            query += lambda q: q.options(selectinload(cls.results))
+
+        return query, params
 
     @property
     def average(self):
@@ -171,6 +727,43 @@ class Runner(Base):
 
         session.add(self)
 
+    @classmethod
+    def bulk_upsert(cls, session, records, status=True):
+        """Add the runners missing from the database.
+
+        Runners are identified by team, name and gender, the unique key of
+        the runners table.  Teams are looked up by name with one query per
+        IN_CHUNK_SIZE teams, and the runners are written with as few
+        statements as HOST_PARAMETER_LIMIT allows.  The runners already in
+        the database are left unchanged; add_result() activates runners,
+        resetting the rating of inactive runners.
+
+        Args:
+            session (Session): Database session object.
+            records (list): Roster records as tuples (name, team, gender),
+                with the team given by name (str).
+            status (bool, optional): Status of the added runners. Defaults
+                to True.
+
+        Returns:
+            List of the runner ids (int), in the order of the records.
+
+        Raises:
+            QueryError: If a team is not found.
+        """
+
+        if len(records) == 0:
+            return []
+
+        team_ids = _team_ids(session, [team for name, team, gender in records])
+        rows = [(name, team_ids[_key_value(team)], gender, status,
+                 name_key(name), phonetic_key(name)) \
+                for name, team, gender in records]
+
+        return _upsert(session, cls, ['name', 'team_id', 'gender', 'status',
+                                      'name_key', 'phonetic_key'],
+                       ['team_id', 'name', 'gender'], None, rows)
+
     def add_result(self, session, result):
         """Add result to database and update runner Speed Rating.
 
@@ -184,23 +777,128 @@ class Runner(Base):
 
         ## Update Speed Rating in database
         if self.rating == None or self.status == False:
+            before = None
             self.status = True
             self.rating = round(result.rating, 3)
         else:
-            diff = abs(result.rating - self.rating)
-            if diff >= 40:
-                new = max(result.rating, self.rating)*0.9 + \
-                      min(result.rating, self.rating)*0.1
-            elif 30 <= diff < 40:
-                new = max(result.rating, self.rating)*0.85 + \
-                      min(result.rating, self.rating)*0.15
-            elif 20 < diff < 30:
-                new = max(result.rating, self.rating)*0.8 + \
-                      min(result.rating, self.rating)*0.2
+            before = self.rating
+            self.rating = self.combine_ratings(self.rating, result.rating)
+
+        ## Record the change in the rating history
+        result.history.append(RatingHistory(runner_id=self.id,
+                                            race=result.name,
+                                            date=result.date,
+                                            rating_before=before,
+                                            rating_after=self.rating))
+
+    @staticmethod
+    def combine_ratings(rating, result_rating):
+        """Combine a current Speed Rating with a new result rating.
+
+        Args:
+            rating (float): Current Speed Rating.
+            result_rating (float): Speed Rating of the new result.
+
+        Returns:
+            Updated Speed Rating, rounded to three decimal places.
+        """
+
+        diff = abs(result_rating - rating)
+        if diff >= 40:
+            new = max(result_rating, rating)*0.9 + \
+                  min(result_rating, rating)*0.1
+        elif 30 <= diff < 40:
+            new = max(result_rating, rating)*0.85 + \
+                  min(result_rating, rating)*0.15
+        elif 20 < diff < 30:
+            new = max(result_rating, rating)*0.8 + \
+                  min(result_rating, rating)*0.2
+        else:
+            new = max(result_rating, rating)*0.75 + \
+                  min(result_rating, rating)*0.25
+
+        return round(new, 3)
+
+    def replay_results(self, session):
+        """Recompute the Speed Rating from the runner's stored results.
+
+        Results are replayed in the order they were processed (by result id),
+        which reproduces the rating built by successive add_result() calls.
+        The rating history of each result is rewritten to match, and missing
+        history rows are created.  Values are only assigned if they changed,
+        so an unaffected runner produces no UPDATE.
+
+        Args:
+            session (Session): Database session object.
+
+        Returns:
+            Tuple of the old and new Speed Ratings.
+        """
+
+        results = session.query(Result).\
+                  filter(Result.runner_id == self.id).\
+                  filter(Result.rating != None).\
+                  order_by(Result.id).all()
+
+        old = self.rating
+
+        ## Runner without results keeps its rating but is inactive
+        if len(results) == 0:
+            if self.status != False:
+                self.status = False
+            return old, old
+
+        new = None
+        for result in results:
+            before = new
+            if new is None:
+                new = round(result.rating, 3)
             else:
-                new = max(result.rating, self.rating)*0.75 + \
-                      min(result.rating, self.rating)*0.25
-            self.rating = round(new, 3)
+                new = self.combine_ratings(new, result.rating)
+
+            ## Bring the rating history of the result up to date
+            if len(result.history) == 0:
+                result.history.append(RatingHistory(runner_id=self.id))
+            for entry in result.history:
+                entry.update(result, before, new)
+
+        if self.status != True:
+            self.status = True
+        if new != old:
+            self.rating = new
+
+        return old, new
+
+    @classmethod
+    def ratings_as_of(cls, session, date, gender=None):
+        """Look up the Speed Rating of every runner as of a past date.
+
+        Uses the rating history, so no results are replayed.  For each 
+        runner the last result processed on or before 'date' is used.
+
+        Args:
+            session (Session): Database session object.
+            date (Date): Date of the ratings.
+            gender (str, optional): Gender filter choice. Defaults to 'None'.
+
+        Returns:
+            Dictionary mapping runner id to Speed Rating. Runners without a
+            result on or before 'date' are omitted.
+        """
+
+        latest = session.query(sql.func.max(RatingHistory.result_id)).\
+                 filter(RatingHistory.date <= date).\
+                 group_by(RatingHistory.runner_id)
+
+        query = session.query(RatingHistory.runner_id,
+                              RatingHistory.rating_after).\
+                filter(RatingHistory.result_id.in_(latest))
+
+        if gender in ['M', 'W']:
+            query = query.join(cls, cls.id == RatingHistory.runner_id).\
+                    filter(cls.gender == gender)
+
+        return dict(query.all())
 
     def sim_races(self, num_races, mode='maxwell', **kwargs):
         """Simulate Speed Ratings based on a particular method.
@@ -244,6 +942,16 @@ class Runner(Base):
 
         return self.ratings_list, self.average
 
+def _set_name_keys(mapper, connection, runner):
+    """Set the name keys of a runner written to the database."""
+
+    if sql.inspect(runner).attrs.name.history.has_changes():
+        runner.name_key = name_key(runner.name or '')
+        runner.phonetic_key = phonetic_key(runner.name or '')
+
+event.listen(Runner, 'before_insert', _set_name_keys)
+event.listen(Runner, 'before_update', _set_name_keys)
+
 ################################################################################
 ##
 ## Result Object
@@ -261,9 +969,15 @@ class Result(Base):
         rating (int): Speed Rating for the result.
         time (str): Race result in HH:MM:SS.ms format.
         runner_id (int): Runner ID for runner who ran this result.
+        race_id (int): Race ID for the race this result is from.
+        history (list): List of RatingHistory objects for the result.
     """
 
     __tablename__ = 'results'
+    __table_args__ = (sql.Index('ix_results_race_rating', 'race_id',
+                                'rating'),
+                      sql.Index('ix_results_runner_date', 'runner_id',
+                                'date'))
 
     ## Result attributes stored in database
     id = sql.Column(sql.Integer, primary_key=True)
@@ -273,6 +987,11 @@ class Result(Base):
     rating = sql.Column(sql.Float)
     time = sql.Column(sql.String)
     runner_id = sql.Column(sql.Integer, sql.ForeignKey('runners.id'))
+    race_id = sql.Column(sql.Integer, sql.ForeignKey('races.id'))
+
+    ## Create one-to-many relationship with RatingHistory table
+    history = relationship("RatingHistory", backref=backref('result'),
+                           cascade='all, delete-orphan')
 
     def __str__(self):
         """Return a string representation of the race result.  
@@ -290,6 +1009,190 @@ class Result(Base):
 
         return "{:<30} {:<10} {:<10} {:<10} {:>8} \n".format(*attributes)
 
+    @classmethod
+    def iter_from_db(cls, session, names=[], dates=[], load_runner=False,
+                     batch_size=1000):
+        """Generate Result objects from database, in processing order.
+
+        Results are loaded in pages of 'batch_size', so only the current
+        page is held in memory by the generator.
+
+        Args:
+            session (Session): Database session object.
+            names (list, optional): Race name(s) (str) to filter by.
+                Defaults to empty list.
+            dates (list, optional): Race date(s) (Date) to filter by.
+                Defaults to empty list.
+            load_runner (bool, optional): Load each result's runner in the 
+                same query. Defaults to False.
+            batch_size (int, optional): Number of results per page. Defaults
+                to 1000.
+
+        Yields:
+            Result objects.
+        """
+
+        if not isinstance(names, list):
+            names = [names]
+        if not isinstance(dates, list):
+            dates = [dates]
+
+        query = _bakery(lambda session: session.query(cls), cls)
+        params = dict()
+
+        ## Filter by race name(s)
+        name_filter = _list_filter(cls.name, names, 'names', params)
+        if name_filter is not None:
+            query.add_criteria(lambda q: q.filter(name_filter),
+                               len(names) > 1)
+
+        ## Filter by race date(s)
+        date_filter = _list_filter(cls.date, dates, 'dates', params)
+        if date_filter is not None:
+            query.add_criteria(lambda q: q.filter(date_filter),
+                               len(dates) > 1)
+
+        if load_runner:
+            query += lambda q: q.options(joinedload(cls.runner))
+
+        for page in _iter_pages(session, query, params, cls.id, batch_size):
+            for result in page:
+                yield result
+
+    @property
+    def seconds(self):
+        """Race time converted to seconds."""
+
+        return time_in_seconds(self.time)
+
+    def correct(self, session, time=None, rating=None, runner_id=None):
+        """Correct this result and update the affected Speed Ratings.
+
+        If only the time is corrected the result rating is shifted by the 
+        time difference using the scale for the race distance, so the r200 
+        of the race does not need to be known.  Only the runner(s) owning 
+        the result are replayed; no other rows are modified.
+
+        Args:
+            session (Session): Database session object.
+            time (str, optional): Corrected time in HH:MM:SS.ms format.
+            rating (float, optional): Corrected result Speed Rating.
+            runner_id (int, optional): ID of the runner the result belongs
+                to, if it was assigned to the wrong runner.
+
+        Returns:
+            Dictionary mapping each affected Runner to a tuple of its old and
+            new Speed Ratings. Runners whose rating did not change are 
+            omitted.
+
+        Raises:
+            QueryError: If the runner is not found.
+        """
+
+        ## Check the runner before changing anything
+        if runner_id is not None and session.query(Runner).get(runner_id) \
+           is None:
+            raise QueryError('No runners found: {0}.'.format(runner_id))
+
+        affected = [self.runner_id]
+
+        if time is not None:
+            old_seconds = self.seconds
+            self.time = time
+            if rating is None and self.rating is not None:
+                delta = self.seconds - old_seconds
+                rating = self.rating - delta/SCALES[int(self.distance)]
+
+        if rating is not None:
+            self.rating = rating
+
+        if runner_id is not None and runner_id != self.runner_id:
+            self.runner_id = runner_id
+            affected.append(runner_id)
+
+        return self._replay(session, affected)
+
+    def remove(self, session):
+        """Delete this result and update the runner's Speed Rating.
+
+        Args:
+            session (Session): Database session object.
+
+        Returns:
+            Dictionary mapping the Runner to a tuple of its old and new 
+            Speed Ratings, empty if the rating did not change.
+        """
+
+        session.delete(self)
+
+        return self._replay(session, [self.runner_id])
+
+    @staticmethod
+    def _replay(session, runner_ids):
+        """Replay results for the given runners and collect the changes."""
+
+        deltas = dict()
+        for runner in session.query(Runner).\
+            filter(Runner.id.in_(runner_ids)).all():
+
+            old, new = runner.replay_results(session)
+            if old != new:
+                deltas[runner] = (old, new)
+
+        return deltas
+
+################################################################################
+##
+## RatingHistory Object
+##
+################################################################################
+
+class RatingHistory(Base):
+    """Represents the change in a runner's Speed Rating caused by a result.
+
+    Attributes:
+        runner_id (int): Runner ID for the runner whose rating changed.
+        result_id (int): Result ID for the result that changed the rating.
+        race (str): Name of race.
+        date (Date): Date of race.
+        rating_before (float): Speed Rating before the result. 'None' if the
+            result started a new rating.
+        rating_after (float): Speed Rating after the result.
+    """
+
+    __tablename__ = 'rating_history'
+    __table_args__ = (sql.Index('ix_rating_history_date_runner', 'date',
+                                'runner_id', 'result_id'),
+                      sql.Index('ix_rating_history_runner_date', 'runner_id',
+                                'date'))
+
+    ## RatingHistory attributes stored in database
+    id = sql.Column(sql.Integer, primary_key=True)
+    runner_id = sql.Column(sql.Integer, sql.ForeignKey('runners.id'))
+    result_id = sql.Column(sql.Integer, sql.ForeignKey('results.id'),
+                           index=True)
+    race = sql.Column(sql.String)
+    date = sql.Column(sql.Date)
+    rating_before = sql.Column(sql.Float)
+    rating_after = sql.Column(sql.Float)
+
+    def update(self, result, rating_before, rating_after):
+        """Assign attributes from a result, only where they changed.
+
+        Args:
+            result (Result): Result that caused the rating change.
+            rating_before (float): Speed Rating before the result.
+            rating_after (float): Speed Rating after the result.
+        """
+
+        values = {'runner_id': result.runner_id, 'race': result.name,
+                  'date': result.date, 'rating_before': rating_before,
+                  'rating_after': rating_after}
+
+        for key, value in values.iteritems():
+            if getattr(self, key) != value:
+                setattr(self, key, value)
+
 ################################################################################
 ##
 ## Team Object
@@ -313,7 +1216,7 @@ class Team(Base):
 
     ## Team attributes stored in database
     id = sql.Column(sql.Integer, primary_key=True)
-    name = sql.Column(sql.String, index=True)
+    name = sql.Column(sql.String, index=True, unique=True)
     region = sql.Column(sql.String)
 
     ## Create one-to-many relationship with Runners table
@@ -322,7 +1225,7 @@ class Team(Base):
     def __init__(self, name, region=None, runners=None):
 
         self.name = name
-        self.region = None
+        self.region = region
 
         if runners is None:
             self.runners = []
@@ -335,15 +1238,44 @@ class Team(Base):
         
 
     @classmethod
-    def from_db(cls, session, names = [], regions=[]):
+    def from_db(cls, session, names = [], regions=[], load_runners=False,
+                gender=None, status=None, top=None, cached=False):
         """Query database and return Teams depending on given filter.
 
+        With 'load_runners' the runners of every team are loaded with one
+        additional query instead of one query per team.  If 'gender' or
+        'status' are also given, only the matching runners are loaded into
+        Team.runners, in the same query as the teams.
+
+        With 'top', only the highest rated matching runners of each team are
+        loaded, in the same query as the teams and ordered by rating.  They
+        are ranked by the database with _rank_runners() over the runner 
+        filter index, so the other runners are never read into Python.
+        Runners without a Speed Rating are not ranked.
+
+        Loading runners repopulates teams already loaded in the session, so
+        Team.runners holds the runners of the last such query, and unsaved
+        changes to those teams and runners are discarded.
+
+        Name and region lists longer than IN_CHUNK_SIZE are split into 
+        chunks queried separately.
+
         Args:
             session (Session): Database Session object.
             names (list, optional): Team name(s) (str)  to filter by. 
                 Defaults to empty list.
             regions (list, optional ): Region(s) (str) to filter by. 
                 Defaults to empty list.
+            load_runners (bool, optional): Load the runners of each team.
+                Defaults to False.
+            gender (str, optional): Gender of runners to load. Defaults to
+                'None'.
+            status (bool, optional): Status of runners to load. Defaults to
+                'None'.
+            top (int, optional): Number of highest rated runners to load for
+                each team. Defaults to 'None', loading all runners.
+            cached (bool, optional): Return detached, read-only Team objects
+                from the query cache. Defaults to False.
 
         Returns:
             Either list of Team objects or single Team object, depending 
@@ -356,27 +1288,153 @@ class Team(Base):
         if not isinstance(regions, list):
             regions = [regions]
 
-        query = session.query(cls)
-
-        ## Filter by team name(s)
-        if len(names) == 1:
-            query = query.filter(cls.name == names[0])
-        elif len(names) > 1:
-            query = query.filter(cls.name.in_(names))
+        if cached:
+            key = ('teams', tuple(names), tuple(regions), load_runners, gender,
+                   status, top)
+            return query_cache.get(session, key, lambda s: cls.from_db(
+                s, names, regions, load_runners, gender, status, top))
 
-        ## Filter by region(s)
-        if len(regions) == 1:
-            query = query.filter(cls.region == regions[0])
-        elif len(regions) > 1:
-            query = query.filter(cls.region.in_(regions))
+        ## Long filter lists are queried in chunks
+        teams = []
+        for name_chunk, region_chunk in _chunk_product(names, regions):
+            query, params = cls._query(name_chunk, region_chunk,
+                                       load_runners, gender, status, top)
+            teams += query(session).params(**params).all()
 
         ## Determine proper return value
-        teams = query.all()
         if len(teams) == 0:
             raise QueryError('No teams found.')
         else:
             return teams
 
+    @classmethod
+    def iter_from_db(cls, session, names=[], regions=[], load_runners=False,
+                     gender=None, status=None, top=None, batch_size=100):
+        """Generate Team objects from database, ordered by id.
+
+        Teams are loaded in pages of 'batch_size'.  The runners of a page 
+        are loaded once the page of teams is known, since a limit on a 
+        query joined to the runners would split a team's runners between
+        pages.  Filters and eager loading are the same as for from_db(); an
+        empty query yields nothing.  Long filter lists are queried in 
+        chunks, each ordered by id.
+
+        Args:
+            session (Session): Database Session object.
+            names (list, optional): Team name(s) (str)  to filter by. 
+                Defaults to empty list.
+            regions (list, optional ): Region(s) (str) to filter by. 
+                Defaults to empty list.
+            load_runners (bool, optional): Load the runners of each team.
+                Defaults to False.
+            gender (str, optional): Gender of runners to load. Defaults to
+                'None'.
+            status (bool, optional): Status of runners to load. Defaults to
+                'None'.
+            top (int, optional): Number of highest rated runners to load for
+                each team. Defaults to 'None', loading all runners.
+            batch_size (int, optional): Number of teams per page. Defaults
+                to 100.
+
+        Yields:
+            Team objects.
+        """
+
+        if not isinstance(names, list):
+            names = [names]           
+        if not isinstance(regions, list):
+            regions = [regions]
+
+        for name_chunk, region_chunk in _chunk_product(names, regions):
+            query, params = cls._query(name_chunk, region_chunk, False, None,
+                                       None, None)
+            for page in _iter_pages(session, query, params, cls.id,
+                                    batch_size):
+                if load_runners:
+                    runner_query, runner_params = cls._query(
+                        [], [], load_runners, gender, status, top)
+                    runner_query += lambda q: q.filter(cls.id.in_(
+                        sql.bindparam('ids', expanding=True)))
+                    page = runner_query(session).\
+                           params(ids=[team.id for team in page],
+                                  **runner_params).all()
+                for team in page:
+                    yield team
+
+    @classmethod
+    def _query(cls, names, regions, load_runners, gender, status, top):
+        """Build the baked query used by from_db() and iter_from_db().
+
+        Criteria are only added for the filters in use, so each combination
+        of filters is compiled once and then reused with new parameters.
+
+        Returns:
+            Tuple of the BakedQuery and its parameters.
+        """
+
+        query = _bakery(lambda session: session.query(cls), cls)
+        params = dict()
+
+        ## Filter by team name(s) and region(s)
+        team_filters = [criterion for criterion in \
+                        [_list_filter(cls.name, names, 'names', params),
+                         _list_filter(cls.region, regions, 'regions', params)] \
+                        if criterion is not None]
+        team_shape = (min(len(names), 2), min(len(regions), 2))
+        if len(team_filters) > 0:
+            query.add_criteria(lambda q: q.filter(*team_filters), *team_shape)
+
+        ## Runner filters used when loading runners
+        runner_filters = []
+        if gender in ['M', 'W']:
+            runner_filters.append(Runner.gender == sql.bindparam('gender'))
+            params['gender'] = gender
+        if status is not None:
+            runner_filters.append(Runner.status == sql.bindparam('status'))
+            params['status'] = status
+        runner_shape = (gender in ['M', 'W'], status is not None)
+
+        ## Load the top runners, all runners, or only those matching the
+        ## runner filters.  Teams already in the session are repopulated, so
+        ## Team.runners always holds the runners of this query
+        if load_runners and top is not None:
+            params['top'] = top
+
+            def load_top(q):
+
+                ## Only runners of the selected teams are ranked
+                statement = sql.select([Runner.id.label('id'),
+                                        Runner.team_id.label('team_id')])
+                if len(runner_filters) > 0:
+                    statement = statement.where(sql.and_(*runner_filters))
+                if len(team_filters) > 0:
+                    statement = statement.where(Runner.team_id.in_(
+                        sql.select([cls.id]).where(sql.and_(*team_filters)).\
+                        correlate(None)))
+                ranked = _rank_runners(statement)
+
+                ## Rank filter is part of the join, so teams without ranked
+                ## runners are still returned
+                return q.outerjoin(ranked, sql.and_(
+                           ranked.c.team_id == cls.id,
+                           ranked.c.rank <= sql.bindparam('top'))).\
+                         outerjoin(Runner, Runner.id == ranked.c.id).\
+                         options(contains_eager(cls.runners)).\
+                         populate_existing().\
+                         order_by(cls.id, ranked.c.rank)
+
+            query.add_criteria(load_top, *(team_shape + runner_shape))
+        elif load_runners and len(runner_filters) > 0:
+            query.add_criteria(lambda q: q.outerjoin(
+                Runner, sql.and_(Runner.team_id == cls.id, *runner_filters)).\
+                options(contains_eager(cls.runners)).populate_existing(),
+                *runner_shape)
+        elif load_runners:
+            query += lambda q: q.options(selectinload(cls.runners)).\
+                               populate_existing()
+
+        return query, params
+
     @reconstructor
     def init_on_load(self):
         """Initialize instance attributes."""
@@ -406,6 +1464,30 @@ class Team(Base):
 
         session.add(self)
 
+    @classmethod
+    def bulk_upsert(cls, session, records):
+        """Add teams to the database, updating the teams already in it.
+
+        Teams are identified by name, and written with as few statements as
+        HOST_PARAMETER_LIMIT allows, which also return their ids.  The teams
+        already in the database have their region updated, unless the
+        record region is None.
+
+        Args:
+            session (Session): Database session object.
+            records (list): Team records as tuples (name, region).
+
+        Returns:
+            List of the team ids (int), in the order of the records.
+        """
+
+        if len(records) == 0:
+            return []
+
+        return _upsert(session, cls, ['name', 'region'], ['name'],
+                       'region = COALESCE(excluded.region, teams.region)',
+                       [tuple(record) for record in records])
+
     def sort_runners(self, key):
         """Sort runners depending on specified key."""
 
@@ -446,38 +1528,64 @@ class Team(Base):
 ##
 ################################################################################
 
-class Race:
-    """Represents a race.
+class Race(Base):
+    """Represents a race contained in the database.
 
-    This Python object will eventually perform all the processing to add
-    race results to the database.
+    A race groups the results of a single gender at a meet.  Results are
+    calculated and added to the database using the race.
 
     Attributes:
         name (str): Name of the race.
         date (Date): Date of race.
         distance (int): Race distance in meters.
-        filename (str): Name of file with race results
+        gender (str): Gender of the race.
+        r200 (float): Time in seconds for a Speed Rating of 200.
+        source (str): Name of file with race results.
+        results (list): List of Result objects for the race.
     """
 
-    def __init__(self, name, date, distance, results=[]):
+    __tablename__ = 'races'
+    __table_args__ = (sql.Index('ix_races_name_date', 'name', 'date'),)
+
+    ## Race attributes stored in database
+    id = sql.Column(sql.Integer, primary_key=True)
+    name = sql.Column(sql.String)
+    date = sql.Column(sql.Date)
+    distance = sql.Column(sql.Integer)
+    gender = sql.Column(sql.String)
+    r200 = sql.Column(sql.Float)
+    source = sql.Column(sql.String)
+
+    ## Create one-to-many relationship with Results table
+    results = relationship("Result", backref=backref('race'),
+                           order_by="Result.id")
+
+    def __init__(self, name, date, distance, results=None, gender=None,
+                 r200=None, source=None):
 
         self.name = name
         self.date = date
-        self.distance = distance
-        self.results = results
+        self.distance = int(distance)
+        self.gender = gender
+        self.r200 = r200
+        self.source = source
         self._is_processed = False
 
-        if distance == 8000:
-            self._scale = 5.0
-        elif distance == 6000:
-            self._scale = 3.75
-        elif distance == 5000:
-            self._scale = 3.0
-        elif distance == 4000:
-            self._scale = 2.5
-        else:
+        if results is not None:
+            self.results = results
+
+        try:
+            self._scale = SCALES[self.distance]
+        except KeyError:
             raise ValueError('Invalid distance {0}.'.format(distance))
 
+    @reconstructor
+    def init_on_load(self):
+        """Initialize instance attributes."""
+
+        self._is_processed = True
+        self._scale = SCALES.get(self.distance)
+
     @classmethod
     def from_csv(cls, resultfile):
 
@@ -491,7 +1599,7 @@ class Race:
                 data.append(str.split(line, ','))
 
             name = data[0][0]
-            distance = data[0][2]
+            distance = int(data[0][2])
             racedate = data[0][1]
             date = datetime.date(int(racedate[6:]), int(racedate[3:5]),
                                       int(racedate[:2]))
@@ -509,7 +1617,53 @@ class Race:
                                                             time % 60.))
                 results.append(new)
 
-            return cls(name, date, distance, results)
+            return cls(name, date, distance, results, source=resultfile)
+
+    @classmethod
+    def from_db(cls, session, names=[], dates=[], gender=None):
+        """Query database and return Races depending on given filter.
+
+        Args:
+            session (Session): Database Session object.
+            names (list, optional): Race name(s) (str) to filter by.
+                Defaults to empty list.
+            dates (list, optional): Race date(s) (Date) to filter by.
+                Defaults to empty list.
+            gender (str, optional): Gender filter choice. Defaults to 'None'.
+
+        Returns:
+            List of Race objects ordered by date.
+        """
+
+        ## Check that list objects are given
+        if not isinstance(names, list):
+            names = [names]
+        if not isinstance(dates, list):
+            dates = [dates]
+
+        query = session.query(cls)
+
+        ## Filter by race name(s)
+        if len(names) == 1:
+            query = query.filter(cls.name == names[0])
+        elif len(names) > 1:
+            query = query.filter(cls.name.in_(names))
+
+        ## Filter by race date(s)
+        if len(dates) == 1:
+            query = query.filter(cls.date == dates[0])
+        elif len(dates) > 1:
+            query = query.filter(cls.date.in_(dates))
+
+        ## Filter by gender
+        if gender in ['M', 'W']:
+            query = query.filter(cls.gender == gender)
+
+        races = query.order_by(cls.date, cls.id).all()
+        if len(races) == 0:
+            raise QueryError('No races found.')
+        else:
+            return races
 
     @property
     def is_processed(self):
@@ -525,24 +1679,215 @@ class Race:
 
     def calculate_ratings(self, r200):
 
+        self.r200 = r200
+
         for result in self.results:
 
-            time_in_s = sum(float(x) * 60 ** i for i,x in \
-                            enumerate(reversed(result.time.split(":"))))
-            new_rating = 200-(time_in_s - r200)/self._scale
+            new_rating = 200-(result.seconds - r200)/self._scale
             result.rating = new_rating      
         
     def process(self, session):
         """Export ratings to a SQL database."""
 
+        session.add(self)
+
         for result in self.results:
             runner = session.query(Runner).\
                      filter(Runner.id == result.runner_id).first()
             runner.add_result(session, result)
             print "Result for {0} added".format(runner.name)
 
+            if self.gender is None:
+                self.gender = runner.gender
+
         self._is_processed = True
 
+################################################################################
+##
+## Alias Objects
+##
+################################################################################
+
+class TeamAlias(Base):
+    """Represents a confirmed match of a team name spelling to a team.
+
+    Spellings found in results files are matched to teams once, so later
+    files using the same spelling are matched by an exact lookup.
+
+    Attributes:
+        alias (str): Team name as spelled in a results file.
+        team_id (int): Team ID for the matched team.
+        team (Team): Matched team.
+    """
+
+    __tablename__ = 'team_aliases'
+
+    ## TeamAlias attributes stored in database
+    id = sql.Column(sql.Integer, primary_key=True)
+    alias = sql.Column(sql.String, index=True, unique=True)
+    team_id = sql.Column(sql.Integer, sql.ForeignKey('teams.id'))
+
+    team = relationship("Team")
+
+    @classmethod
+    def lookup(cls, session, aliases):
+        """Return the teams matched to known spellings.
+
+        Args:
+            session (Session): Database session object.
+            aliases (list): Team name spellings (str) to look up.
+
+        Returns:
+            Dictionary mapping each known spelling to its Team object.
+            Unknown spellings are left out.
+        """
+
+        spellings = dict((_key_value(alias), alias) for alias in aliases)
+
+        teams = dict()
+        for chunk in _chunks(spellings.keys()):
+            if len(chunk) == 0:
+                continue
+            for alias, team in session.query(cls.alias, Team).\
+                                join(Team, Team.id == cls.team_id).\
+                                filter(cls.alias.in_(chunk)):
+                teams[spellings[alias]] = team
+
+        return teams
+
+    @classmethod
+    def add(cls, session, records):
+        """Store confirmed team matches, replacing earlier matches.
+
+        Args:
+            session (Session): Database session object.
+            records (list): Tuples (alias, team) of a spelling and the name
+                (str) of its team.
+
+        Returns:
+            List of the alias ids (int), in the order of the records.
+
+        Raises:
+            QueryError: If a team is not found.
+        """
+
+        if len(records) == 0:
+            return []
+
+        team_ids = _team_ids(session, [team for alias, team in records])
+        rows = [(alias, team_ids[_key_value(team)]) for alias, team in records]
+
+        return _upsert(session, cls, ['alias', 'team_id'], ['alias'],
+                       'team_id = excluded.team_id', rows)
+
+class RunnerAlias(Base):
+    """Represents a confirmed match of a runner name spelling to a runner.
+
+    Spellings are scoped by team, since the same spelling may be a
+    different runner on another team.
+
+    Attributes:
+        alias (str): Runner name as spelled in a results file.
+        team_id (int): Team ID for the team the spelling was listed under.
+        runner_id (int): Runner ID for the matched runner.
+        runner (Runner): Matched runner.
+    """
+
+    __tablename__ = 'runner_aliases'
+    __table_args__ = (sql.Index('ix_runner_aliases_team_alias', 'team_id',
+                                'alias', unique=True),)
+
+    ## RunnerAlias attributes stored in database
+    id = sql.Column(sql.Integer, primary_key=True)
+    alias = sql.Column(sql.String)
+    team_id = sql.Column(sql.Integer, sql.ForeignKey('teams.id'))
+    runner_id = sql.Column(sql.Integer, sql.ForeignKey('runners.id'))
+
+    runner = relationship("Runner")
+
+    @classmethod
+    def lookup(cls, session, pairs, gender=None):
+        """Return the runners matched to known spellings.
+
+        Args:
+            session (Session): Database session object.
+            pairs (list): Tuples (alias, team) of a spelling and the name
+                (str) of the team it was listed under.
+            gender (str, optional): Gender of the matched runners. Defaults
+                to 'None'.
+
+        Returns:
+            Dictionary mapping each known pair to its Runner object.
+            Unknown pairs are left out.
+        """
+
+        spellings = dict(((_key_value(alias), _key_value(team)),
+                          (alias, team)) for alias, team in pairs)
+        aliases = list(set(alias for alias, team in spellings))
+        team_list = list(set(team for alias, team in spellings))
+
+        runners = dict()
+        for alias_chunk, team_chunk in _chunk_product(aliases, team_list):
+            if len(alias_chunk) == 0:
+                continue
+            query = session.query(cls.alias, Team.name, Runner).\
+                    join(Runner, Runner.id == cls.runner_id).\
+                    join(Team, Team.id == cls.team_id).\
+                    filter(cls.alias.in_(alias_chunk)).\
+                    filter(Team.name.in_(team_chunk))
+            if gender in ['M', 'W']:
+                query = query.filter(Runner.gender == gender)
+            for alias, team, runner in query:
+                if (alias, team) in spellings:
+                    runners[spellings[(alias, team)]] = runner
+
+        return runners
+
+    @classmethod
+    def add(cls, session, records):
+        """Store confirmed runner matches, replacing earlier matches.
+
+        The spelling is scoped by the team of the matched runner.
+
+        Args:
+            session (Session): Database session object.
+            records (list): Tuples (alias, runner_id) of a spelling and the
+                id (int) of its runner.
+
+        Returns:
+            List of the alias ids (int), in the order of the records.
+
+        Raises:
+            QueryError: If a runner is not found.
+        """
+
+        if len(records) == 0:
+            return []
+
+        runner_ids = list(set(runner_id for alias, runner_id in records))
+        team_ids = dict()
+        for chunk in _chunks(runner_ids):
+            for runner_id, team_id in session.query(Runner.id,
+                                                    Runner.team_id).\
+                                      filter(Runner.id.in_(chunk)):
+                team_ids[runner_id] = team_id
+
+        missing = [str(runner_id) for runner_id in runner_ids \
+                   if runner_id not in team_ids]
+        if len(missing) > 0:
+            raise QueryError('No runners found: {0}.'.format(
+                ', '.join(sorted(missing))))
+
+        rows = [(alias, team_ids[runner_id], runner_id) for alias, runner_id \
+                in records]
+
+        return _upsert(session, cls, ['alias', 'team_id', 'runner_id'],
+                       ['team_id', 'alias'], 'runner_id = excluded.runner_id',
+                       rows)
+
+## Cached queries are cleared when runners, teams or results change
+query_cache.watch(Runner, Team, Result)
+
 ################################################################################
 ##
 ## Main Function
@@ -19,3 +19,7 @@ class QueryError(Error):
     """Raised when a SQLite query returns an empty list."""
     pass
 
+
+class WriteBackError(Error):
+    """Raised when an in-memory database cannot be written back to disk."""
+    pass
@@ -0,0 +1,116 @@
+"""Streaming exporters for use with NIRCAdb Package.
+
+This contains the functions that write database objects to CSV and JSON
+files one row at a time.  Fed by the iter_from_db() generators, any number
+of runners, teams or results can be exported in constant memory.
+
+Fields are attribute names of the exported objects, and may follow
+relationships using dots, e.g. 'team.name' for a runner.
+
+"""
+
+################################################################################
+##
+## Modules and Packages
+##
+################################################################################
+
+import collections
+import csv
+import datetime
+import json
+
+################################################################################
+##
+## Helper Functions
+##
+################################################################################
+
+def _value(obj, field):
+    """Return the value of a dotted attribute path, or None if unset."""
+
+    for name in field.split('.'):
+        if obj is None:
+            return None
+        obj = getattr(obj, name)
+
+    return obj
+
+def _format(value):
+    """Format a value for CSV or text output.
+
+    None is written as an empty string, lists are joined with semicolons and
+    unicode is encoded as UTF-8.
+    """
+
+    if value is None:
+        return ''
+    elif isinstance(value, list):
+        return '; '.join(_format(item) for item in value)
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    else:
+        return str(value)
+
+def _json_default(value):
+    """Serialize values the json module does not support."""
+
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError('{0!r} is not JSON serializable.'.format(value))
+
+################################################################################
+##
+## Exporters
+##
+################################################################################
+
+def write_csv(filename, objects, fields):
+    """Write objects to a CSV file, one row per object.
+
+    Args:
+        filename (str): Output filename.
+        objects (iterable): Objects to write, e.g. a generator.
+        fields (list): Attribute names (str) written as columns.
+
+    Returns:
+        Number of rows written.
+    """
+
+    count = 0
+    with open(filename, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for obj in objects:
+            writer.writerow([_format(_value(obj, field)) for field in fields])
+            count += 1
+
+    return count
+
+def write_json(filename, objects, fields):
+    """Write objects to a JSON file as a list of dictionaries.
+
+    The list is written one element at a time, instead of being built in
+    memory and dumped at once.
+
+    Args:
+        filename (str): Output filename.
+        objects (iterable): Objects to write, e.g. a generator.
+        fields (list): Attribute names (str) written as keys.
+
+    Returns:
+        Number of elements written.
+    """
+
+    count = 0
+    with open(filename, 'w') as f:
+        f.write('[')
+        for obj in objects:
+            element = collections.OrderedDict((field, _value(obj, field)) \
+                                              for field in fields)
+            f.write(',\n' if count > 0 else '\n')
+            f.write(json.dumps(element, default=_json_default))
+            count += 1
+        f.write('\n]\n' if count > 0 else ']\n')
+
+    return count
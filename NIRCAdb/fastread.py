@@ -0,0 +1,331 @@
+"""Fast read queries for use with NIRCAdb Package.
+
+This contains read-only queries built on SQLAlchemy Core select() statements
+instead of the ORM.  Rows are returned as plain tuples, lightweight records
+or NumPy structured arrays, which avoids building Runner and Team objects
+for code that only needs a few columns.
+
+Every query takes an 'output' argument:
+
+    * 'tuples': List of tuples, in the order of the query fields.
+
+    * 'records': List of Record objects with the fields as attributes.
+
+    * 'array': NumPy structured array with the fields as columns. Missing
+          integers are -1, missing floats are NaN and missing strings are
+          empty.
+
+"""
+
+################################################################################
+##
+## Modules and Packages
+##
+################################################################################
+
+import collections
+
+import numpy as np
+import sqlalchemy as sql
+
+from database import Runner, Team, _rank_runners
+from errors import QueryError
+from snapshot import to_array
+
+## Fields returned by the runner queries and their array kinds
+RUNNER_FIELDS = [('id', 'int'), ('name', 'str'), ('team_id', 'int'),
+                 ('team', 'str'), ('region', 'str'), ('gender', 'str'),
+                 ('rating', 'float'), ('status', 'bool')]
+
+## Fields returned by team_sizes() and their array kinds
+TEAM_SIZE_FIELDS = [('id', 'int'), ('team', 'str'), ('region', 'str'),
+                    ('size', 'int')]
+
+OUTPUTS = ['tuples', 'records', 'array']
+
+################################################################################
+##
+## Record Objects
+##
+################################################################################
+
+class Record(object):
+    """Base class of lightweight read-only rows."""
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+
+        for field, value in zip(self.__slots__, values):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Records are read-only.')
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, ', '.join(
+            '{0}={1!r}'.format(field, value) for field, value in \
+            zip(self.__slots__, self)))
+
+class RunnerRecord(Record):
+    """Represents a runner row with its team name and region."""
+
+    __slots__ = tuple(field for field, kind in RUNNER_FIELDS)
+
+class TeamSizeRecord(Record):
+    """Represents a team row with its number of runners."""
+
+    __slots__ = tuple(field for field, kind in TEAM_SIZE_FIELDS)
+
+################################################################################
+##
+## Helper Functions
+##
+################################################################################
+
+def _filter(statement, column, values):
+    """Filter a statement by one or more values of a column."""
+
+    if not isinstance(values, list):
+        values = [values]
+
+    if len(values) == 1:
+        return statement.where(column == values[0])
+    elif len(values) > 1:
+        return statement.where(column.in_(values))
+    else:
+        return statement
+
+def _runner_select(names, team_list, regions, gender, status):
+    """Build the select statement of the runner fields."""
+
+    runners = Runner.__table__
+    teams = Team.__table__
+
+    statement = sql.select([runners.c.id.label('id'),
+                            runners.c.name.label('name'),
+                            runners.c.team_id.label('team_id'),
+                            teams.c.name.label('team'),
+                            teams.c.region.label('region'),
+                            runners.c.gender.label('gender'),
+                            runners.c.rating.label('rating'),
+                            runners.c.status.label('status')]).\
+                select_from(runners.outerjoin(
+                    teams, teams.c.id == runners.c.team_id))
+
+    statement = _filter(statement, runners.c.name, names)
+    statement = _filter(statement, teams.c.name, team_list)
+    statement = _filter(statement, teams.c.region, regions)
+    if gender in ['M', 'W']:
+        statement = statement.where(runners.c.gender == gender)
+    if status is not None:
+        statement = statement.where(runners.c.status == status)
+
+    return statement
+
+def _convert(rows, fields, record_class, output):
+    """Convert result rows to the requested output type."""
+
+    if output == 'tuples':
+        return [tuple(row) for row in rows]
+    elif output == 'records':
+        return [record_class(*row) for row in rows]
+    elif output == 'array':
+        columns = zip(*rows) if len(rows) > 0 else [[]]*len(fields)
+        arrays = [to_array(column, kind) for (field, kind), column in \
+                  zip(fields, columns)]
+        dtype = [(field, array.dtype) for (field, kind), array in \
+                 zip(fields, arrays)]
+        result = np.empty(len(rows), dtype=dtype)
+        for (field, kind), array in zip(fields, arrays):
+            result[field] = array
+        return result
+    else:
+        raise KeyError("'{0}' is not a valid output.".format(output))
+
+def _group(rows, fields, output):
+    """Group runner rows by team name, keeping their order."""
+
+    grouped = collections.OrderedDict()
+    for row in rows:
+        grouped.setdefault(row[3], []).append(row)
+
+    for team, team_rows in grouped.iteritems():
+        grouped[team] = _convert(team_rows, fields, RunnerRecord, output)
+
+    return grouped
+
+################################################################################
+##
+## Fast Read Queries
+##
+################################################################################
+
+def runners(session, names=[], team_list=[], regions=[], gender=None,
+            status=None, output='tuples'):
+    """Query runners with their team name and region, ordered by id.
+
+    Args:
+        session (Session): Database session object.
+        names (list, optional): Runner name(s) (str) to filter by. Defaults
+            to empty list.
+        team_list (list, optional): Team name(s) (str) to filter by.
+            Defaults to empty list.
+        regions (list, optional): Region(s) (str) to filter by. Defaults to
+            empty list.
+        gender (str, optional): Gender filter choice. Defaults to 'None'.
+        status (bool, optional): Status filter choice. Defaults to 'None'.
+        output (str, optional): Output type. Defaults to 'tuples'.
+
+    Returns:
+        Runner rows with fields RUNNER_FIELDS, as the output type.
+
+    Raises:
+        QueryError: If no runners are found.
+    """
+
+    statement = _runner_select(names, team_list, regions, gender, status).\
+                order_by(Runner.__table__.c.id)
+
+    rows = session.execute(statement).fetchall()
+    if len(rows) == 0:
+        raise QueryError('No runners found.')
+
+    return _convert(rows, RUNNER_FIELDS, RunnerRecord, output)
+
+def team_rosters(session, team_list=[], regions=[], gender=None, status=None,
+                 output='tuples'):
+    """Query the runners of each team, ordered by rating.
+
+    Args:
+        session (Session): Database session object.
+        team_list (list, optional): Team name(s) (str) to filter by.
+            Defaults to empty list.
+        regions (list, optional): Region(s) (str) to filter by. Defaults to
+            empty list.
+        gender (str, optional): Gender filter choice. Defaults to 'None'.
+        status (bool, optional): Status filter choice. Defaults to 'None'.
+        output (str, optional): Output type of each roster. Defaults to
+            'tuples'.
+
+    Returns:
+        Ordered dictionary mapping team name to its runner rows, with teams
+        in name order.
+
+    Raises:
+        QueryError: If no runners are found.
+    """
+
+    runners = Runner.__table__
+    teams = Team.__table__
+
+    statement = _runner_select([], team_list, regions, gender, status).\
+                where(runners.c.team_id != None).\
+                order_by(teams.c.name, runners.c.rating.desc(), runners.c.id)
+
+    rows = session.execute(statement).fetchall()
+    if len(rows) == 0:
+        raise QueryError('No runners found.')
+
+    return _group(rows, RUNNER_FIELDS, output)
+
+def team_sizes(session, names=[], regions=[], gender=None, status=None,
+               output='tuples'):
+    """Count the runners of each team with a single aggregate query.
+
+    Args:
+        session (Session): Database session object.
+        names (list, optional): Team name(s) (str) to filter by. Defaults
+            to empty list.
+        regions (list, optional): Region(s) (str) to filter by. Defaults to
+            empty list.
+        gender (str, optional): Gender of runners counted. Defaults to
+            'None'.
+        status (bool, optional): Status of runners counted. Defaults to
+            'None'.
+        output (str, optional): Output type. Defaults to 'tuples'.
+
+    Returns:
+        Team rows with fields TEAM_SIZE_FIELDS in team name order, as the
+        output type.  Teams without matching runners have size 0.
+
+    Raises:
+        QueryError: If no teams are found.
+    """
+
+    runners = Runner.__table__
+    teams = Team.__table__
+
+    ## Runner filters belong to the join, so empty teams are still counted
+    criteria = [runners.c.team_id == teams.c.id]
+    if gender in ['M', 'W']:
+        criteria.append(runners.c.gender == gender)
+    if status is not None:
+        criteria.append(runners.c.status == status)
+
+    statement = sql.select([teams.c.id, teams.c.name, teams.c.region,
+                            sql.func.count(runners.c.id)]).\
+                select_from(teams.outerjoin(runners, sql.and_(*criteria))).\
+                group_by(teams.c.id).\
+                order_by(teams.c.name, teams.c.id)
+
+    statement = _filter(statement, teams.c.name, names)
+    statement = _filter(statement, teams.c.region, regions)
+
+    rows = session.execute(statement).fetchall()
+    if len(rows) == 0:
+        raise QueryError('No teams found.')
+
+    return _convert(rows, TEAM_SIZE_FIELDS, TeamSizeRecord, output)
+
+def top_runners(session, n=7, team_list=[], regions=[], gender=None,
+                status=True, output='tuples'):
+    """Query the n highest rated runners of each team.
+
+    Runners are ranked within their team by the same ROW_NUMBER() window as
+    Team.from_db(top=...), so only the selected runners are read from the
+    database.  Runners without a
+    Speed Rating are not ranked.
+
+    Args:
+        session (Session): Database session object.
+        n (int, optional): Number of runners per team. Defaults to 7.
+        team_list (list, optional): Team name(s) (str) to filter by.
+            Defaults to empty list.
+        regions (list, optional): Region(s) (str) to filter by. Defaults to
+            empty list.
+        gender (str, optional): Gender filter choice. Defaults to 'None'.
+        status (bool, optional): Status filter choice. Defaults to True.
+        output (str, optional): Output type of each team. Defaults to
+            'tuples'.
+
+    Returns:
+        Ordered dictionary mapping team name to its runner rows ordered by
+        rating, with teams in name order.
+
+    Raises:
+        QueryError: If no runners are found.
+    """
+
+    ranked = _rank_runners(_runner_select([], team_list, regions, gender,
+                                          status))
+
+    statement = sql.select([ranked.c[field] for field, kind in \
+                            RUNNER_FIELDS]).\
+                where(ranked.c.rank <= n).\
+                order_by(ranked.c.team, ranked.c.team_id, ranked.c.rank)
+
+    rows = session.execute(statement).fetchall()
+    if len(rows) == 0:
+        raise QueryError('No runners found.')
+
+    return _group(rows, RUNNER_FIELDS, output)
@@ -222,15 +222,26 @@ class TeamMatchPage(QtGui.QWizardPage):
             team_names = list(team_names)
 
         ## Query database for list of teams
-        with ndb.db_session(self.database_ref) as session:
-            database_teams = ndb.Team.from_db(session)
+        with ndb.db_session(self.database_ref,
+                            readonly=True) as session:
+            database_teams = ndb.Team.from_db(session, cached=True)
             self.database_team_names = [team.name for team in database_teams]
+            team_index = ndbsearch.NameIndex((team, team.name) for team in \
+                                             database_teams)
+
+            ## Spellings confirmed in earlier files need no fuzzy search
+            team_aliases = ndb.TeamAlias.lookup(session, team_names)
 
             team_matches = []
             for team_name in team_names:
 
+                if team_name in team_aliases:
+                    team_matches.append((team_name,
+                                         team_aliases[team_name].name, 100))
+                    continue
+
                 team_match = ndbsearch.team_search(team_name, limit=1,
-                                                   team_list=database_teams)[0]
+                                                   index=team_index)[0]
                 
                 
                 team_matches.append((team_name, team_match[0].name,
@@ -301,27 +312,50 @@ class RunnerMatchPage(QtGui.QWizardPage):
                                          runner_time))
 
         ## Query database for list of runners
-        with ndb.db_session(self.database_ref) as session:
+        with ndb.db_session(self.database_ref,
+                            readonly=True) as session:
             team_list = list(team_dict.values())
 
             ## Get runners from all teams in the race
             database_runners = ndb.Runner.from_db(session,
                                                   team_list=team_list,
-                                                  gender=race_gender)
+                                                  gender=race_gender,
+                                                  load_team=True,
+                                                  cached=True)
+
+            ## Find a database match for every runner in the results file,
+            ## searching only spellings not confirmed in earlier files
+            pairs = [(runner_info[0], runner_info[1]) for runner_info in \
+                     runner_info_list]
+            runner_aliases = ndb.RunnerAlias.lookup(session, pairs,
+                                                    gender=race_gender)
+            ## Runners confirmed for a spelling are not matched again
+            claimed = set(runner.id for runner in runner_aliases.values())
+            new_pairs = [pair for pair in pairs if pair not in runner_aliases]
+            new_results = iter(ndbsearch.batch_runner_search(
+                new_pairs, runner_list=[runner for runner in \
+                                        database_runners if \
+                                        runner.id not in claimed]))
+
+            search_results = []
+            for pair in pairs:
+                if pair in runner_aliases:
+                    search_results.append((runner_aliases[pair], 100))
+                else:
+                    search_results.append(next(new_results))
+
+            team_runner_names = dict()
+            for runner in database_runners:
+                team_runner_names.setdefault(runner.team.name, []).\
+                    append(runner.name)
 
             runner_matches = []
             self.database_runner_names = []
 
-            ## Find a database match for each runner in the results file
-            for runner_info in runner_info_list:
-
-                runner_list = [runner for runner in database_runners if
-                               runner.team.name == runner_info[1]]
-
-                if len(runner_list) > 0:
+            for runner_info, search_result in zip(runner_info_list,
+                                                  search_results):
 
-                    search_result = ndbsearch.runner_search(runner_info[0], limit=1,
-                                                            runner_list=runner_list)[0]
+                if search_result[0] is not None:
 
                     if self.guess == False:
                         if search_result[1] < 100:
@@ -338,14 +372,15 @@ class RunnerMatchPage(QtGui.QWizardPage):
                                         search_result[1], runner_info[1],
                                         runner_info[2])
 
+                ## Unmatched names are suggested as new runners
                 else:
-                    runner_match = (runner_info[0], '', 0, runner_info[1],
-                                    runner_info[2])
+                    runner_match = (runner_info[0], runner_info[0], 0,
+                                    runner_info[1], runner_info[2])
 
                 runner_matches.append(runner_match)
                 
-                self.database_runner_names.append([runner.name for \
-                                                   runner in runner_list])
+                self.database_runner_names.append(
+                    team_runner_names.get(runner_info[1], []))
 
         ## Create a MultiMatchDisplay
         self.runnermatchesDisplay = RunnerMultiDisplay(runner_matches,
@@ -402,22 +437,31 @@ class ResultsPage(QtGui.QWizardPage):
 
         print len(self.runner_matches)
         
-        with ndb.db_session(self.database_ref) as session:
+        with ndb.db_session(self.database_ref,
+                            readonly=True) as session:
             
+            ## Load the matched runners of every team with one query
+            database_runners = dict()
+            try:
+                names = list(set(match[1] for match in self.runner_matches))
+                for runner in ndb.Runner.from_db(session, names=names,
+                                                 team_list=team_dict.keys(),
+                                                 load_team=True):
+                    database_runners.setdefault((runner.name,
+                                                 runner.team.name), runner)
+            except ndberrors.QueryError:
+                pass
+
             for i, match in enumerate(self.runner_matches):
 
                 ## Check if scoring runners needed
-                try:
-                    runner = ndb.Runner.from_db(session,
-                                                names = match[1],
-                                                team_list = match[3])[0]
-                    team_dict[match[3]].append(runner)
-
-                    print "{0}, {1}".format(i, runner.name)
-                    
-                except ndberrors.QueryError:
+                runner = database_runners.get((match[1], match[3]))
+                if runner is None:
                     print "Skip, {0}".format(i)
-                    pass
+                    continue
+
+                team_dict[match[3]].append(runner)
+                print "{0}, {1}".format(i, runner.name)
 
             ## Determine which teams can be scored
             for key, value in team_dict.iteritems():
@@ -504,22 +548,28 @@ class ModifyPage(QtGui.QWizardPage):
         result_list = []
         old_ratings = []
         with ndb.db_session(self.database_ref) as session:
-            
-            for i, match in enumerate(self.runner_matches):
-
-                try:
-                    runner = ndb.Runner.from_db(session,
-                                                names = match[1],
-                                                team_list=match[3])[0]
-                except ndberrors.QueryError:
-                    runner = ndb.Runner(name = match[1], status = True,
-                                    gender = self.race_gender)
-
-                    team = ndb.Team.from_db(session,
-                                            names = match[3])[0]
-                    team.runners.append(runner)
-                    session.flush()
 
+            ## Add all new runners at once and load every matched runner
+            records = [(match[1], match[3], self.race_gender) for match in \
+                       self.runner_matches]
+            ids = ndb.Runner.bulk_upsert(session, records)
+            runners = dict((runner.id, runner) for runner in \
+                           session.query(ndb.Runner).\
+                           filter(ndb.Runner.id.in_(set(ids))))
+
+            ## Confirmed spellings, remembered when the race is added so
+            ## later files match them without fuzzy search
+            team_matches = self.field('team_matches').toPyObject()
+            self.team_aliases = [(match[0], match[1]) for match in \
+                                 team_matches if match[2] == 100 and \
+                                 match[0] != match[1]]
+            self.runner_aliases = [(match[0], runner_id) for runner_id, \
+                                   match in zip(ids, self.runner_matches) if \
+                                   match[2] == 100 and match[0] != match[1]]
+
+            for runner_id, match in zip(ids, self.runner_matches):
+
+                runner = runners[runner_id]
                 print runner.id, runner.name
 
                 result = ndb.Result(name=self.race_name,
@@ -532,7 +582,9 @@ class ModifyPage(QtGui.QWizardPage):
 
         race = ndb.Race(self.race_name,
                         self.race_date,
-                        self.race_distance, result_list)
+                        self.race_distance, result_list,
+                        gender=self.race_gender,
+                        source=str(self.field('filename').toString()))
 
         self.raceTable.addRace(race, old_ratings)
 
@@ -564,7 +616,10 @@ class ModifyPage(QtGui.QWizardPage):
     @QtCore.pyqtSlot()
     def add(self):
 
+        ## Aliases are only written with the race, in the same transaction
         with ndb.db_session(self.database_ref) as session:
+            ndb.TeamAlias.add(session, self.team_aliases)
+            ndb.RunnerAlias.add(session, self.runner_aliases)
             self.raceTable.race.process(session)
 
 class ConclusionPage(QtGui.QWizardPage):
@@ -591,12 +646,21 @@ class ChangeTeamDialog(QtGui.QDialog):
         match (str): Database match for the given name.
     """
 
-    def __init__(self, name, database_names, database_ref):
+    def __init__(self, name, database_ref):
         super(ChangeTeamDialog, self).__init__()
 
         self.match = None
         self.database_ref = database_ref
 
+        ## Reload the team list from the query cache, so teams added by an
+        ## earlier dialog are listed
+        with ndb.db_session(self.database_ref, readonly=True) as session:
+            try:
+                database_names = [team.name for team in \
+                                  ndb.Team.from_db(session, cached=True)]
+            except ndberrors.QueryError:
+                database_names = []
+
         ## Create QWidget objects
         self.selectLabel = QtGui.QLabel('Select New')
         self.nameComboBox = QtGui.QComboBox()
@@ -638,8 +702,8 @@ class ChangeTeamDialog(QtGui.QDialog):
         self.setLayout(layout)
 
     @staticmethod
-    def getMatch(name, database_names, database_ref):
-        dialog = ChangeTeamDialog(name, database_names, database_ref)
+    def getMatch(name, database_ref):
+        dialog = ChangeTeamDialog(name, database_ref)
         result = dialog.exec_()
         new = dialog.match
         return (new, result == QtGui.QDialog.Accepted)
@@ -837,7 +901,6 @@ class TeamMultiDisplay(MultiMatchDisplay):
 
         ## Select new match using dialog
         new_match, ok = ChangeTeamDialog.getMatch(self.nameLabels[index].text(),
-                                                  self.database_names,
                                                   self.database_ref)
 
         ## Check if valid and update
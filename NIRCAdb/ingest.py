@@ -0,0 +1,418 @@
+"""Headless result ingest for use with NIRCAdb Package.
+
+This contains the objects that add a formatted results file to the database
+without the update wizard.  Each line of the file holds a runner name, team
+name and time.  The teams and runners are matched to the database, the 200
+Speed Rating time is calibrated from the ratings of the matched runners,
+and the race is added to the database.
+
+Matches at or above the auto-accept thresholds are accepted.  Names with no
+match scoring at least the new runner threshold are only added as new
+runners when asked.  Every other row is held out of the race and written to
+a review report.  A race with too few rated runners to calibrate the time is
+only added with a time given by hand.
+
+"""
+
+################################################################################
+##
+## Modules and Packages
+##
+################################################################################
+
+import csv
+import os
+
+import numpy as np
+
+from database import Runner, Team, Result, Race, TeamAlias, RunnerAlias
+from database import SCALES, time_in_seconds
+from errors import QueryError
+from export import _format
+import search
+
+## Lowest team and runner ratios accepted without review
+TEAM_THRESHOLD = 90
+RUNNER_THRESHOLD = 90
+
+## Lowest ratio of a runner match.  Names scoring below it on every runner of
+## their team have no match, and are candidates for new runners
+NEW_THRESHOLD = 50
+
+## Largest difference between a runner's rating and race rating used to
+## calibrate the 200 Speed Rating time
+R200_TOLERANCE = 20.0
+
+## Fewest rated runners needed to calibrate the 200 Speed Rating time
+MIN_CALIBRATION_SIZE = 5
+
+################################################################################
+##
+## Helper Functions
+##
+################################################################################
+
+def read_results(resultfile):
+    """Read (name, team, time) rows from a formatted results file.
+
+    Blank lines are skipped and a missing time is read as 'None'.
+    """
+
+    rows = []
+    with open(resultfile, 'rb') as f:
+        for line in csv.reader(f):
+            if len(line) < 2 or not line[0].strip():
+                continue
+            time = line[2].strip() if len(line) > 2 else ''
+            rows.append((line[0].strip(), line[1].strip(), time or None))
+
+    return rows
+
+def calibrate_r200(seconds, ratings, distance, tolerance=R200_TOLERANCE):
+    """Find the 200 Speed Rating time that best fits the runners' ratings.
+
+    Every rated runner gives an estimate of the time, the time for which
+    its race rating equals its rating.  Starting from the median estimate,
+    the time is set to the mean estimate of the runners whose race rating
+    is within the tolerance of their rating, until those runners do not
+    change.  This minimizes the same squared error the update wizard shows.
+
+    Args:
+        seconds (list): Race times (float) in seconds of the rated runners.
+        ratings (list): Speed Ratings (float) of the rated runners.
+        distance (int): Race distance in meters.
+        tolerance (float, optional): Largest rating difference used.
+            Defaults to R200_TOLERANCE.
+
+    Returns:
+        Tuple (r200, error, size) of the time, the squared error and the
+        number of runners within the tolerance.  The time is 'None' if
+        there are no rated runners.
+    """
+
+    scale = SCALES[distance]
+    estimates = np.asarray(seconds, dtype=float) + \
+                scale*(np.asarray(ratings, dtype=float) - 200.)
+    if len(estimates) == 0:
+        return (None, 0., 0)
+
+    r200 = float(np.median(estimates))
+    inliers = None
+    for i in range(len(estimates)):
+        within = np.abs(estimates - r200) <= tolerance*scale
+        if not within.any() or \
+           (inliers is not None and (within == inliers).all()):
+            break
+        inliers = within
+        r200 = float(estimates[inliers].mean())
+
+    diffs = (estimates - r200)/scale
+    within = np.abs(diffs) <= tolerance
+
+    return (r200, float((diffs[within]**2).sum()), int(within.sum()))
+
+################################################################################
+##
+## Ingest Object
+##
+################################################################################
+
+class Ingest:
+    """Represents the ingest of one formatted results file.
+
+    Each row is a dictionary with the REPORT_FIELDS and the id of its
+    runner.  Its status is 'accepted' for a runner match at or above the
+    threshold, 'new' for a name without a match when new runners are
+    created, and 'review' for a row held out of the race.
+
+    Attributes:
+        resultfile (str): Name of the formatted results file.
+        name (str): Name of the race.
+        date (Date): Date of race.
+        distance (int): Race distance in meters.
+        gender (str): Gender of the race.
+        team_threshold (int): Lowest team ratio accepted.
+        runner_threshold (int): Lowest runner ratio accepted.
+        new_threshold (int): Lowest ratio of a runner match; names without
+            a match are new runners.
+        create_new (bool): True to add names without a match as new
+            runners, instead of holding them.
+        rows (list): List of rows, in finishing order.  Empty until
+            match() is called.
+        r200 (float): Time in seconds for a Speed Rating of 200.  None
+            until calibrate() is called, or if it could not be calibrated.
+        error (float): Squared rating error of the calibrated time.
+        calibration_size (int): Number of runners the time was calibrated
+            from.
+    """
+
+    REPORT_FIELDS = ['name', 'team', 'time', 'team_match', 'team_ratio',
+                     'runner_match', 'runner_ratio', 'status', 'reason']
+
+    def __init__(self, resultfile, name, date, distance, gender,
+                 team_threshold=TEAM_THRESHOLD,
+                 runner_threshold=RUNNER_THRESHOLD,
+                 new_threshold=NEW_THRESHOLD, create_new=False):
+
+        if int(distance) not in SCALES:
+            raise ValueError('Invalid distance {0}.'.format(distance))
+        if gender not in ['M', 'W']:
+            raise ValueError('Invalid gender {0}.'.format(gender))
+
+        self.resultfile = resultfile
+        self.name = name
+        self.date = date
+        self.distance = int(distance)
+        self.gender = gender
+        self.team_threshold = team_threshold
+        self.runner_threshold = runner_threshold
+        self.new_threshold = new_threshold
+        self.create_new = create_new
+        self.rows = []
+        self.r200 = None
+        self.error = None
+        self.calibration_size = 0
+
+    def rows_with_status(self, *statuses):
+        """Return the rows with any of the given statuses."""
+
+        return [row for row in self.rows if row['status'] in statuses]
+
+    @property
+    def calibrated(self):
+        return self.r200 is not None
+
+    def match(self, session, processes=1):
+        """Match every row of the results file to a team and runner.
+
+        Spellings confirmed in earlier files are matched by their aliases.
+        The other teams are searched one at a time, and the other runners
+        are matched in one batch, in the given number of processes.
+
+        Args:
+            session (Session): Database session object.
+            processes (int, optional): Number of worker processes runners
+                are matched in. Defaults to 1.
+
+        Returns:
+            List of rows.
+        """
+
+        self.rows = [dict(name=name, team=team, time=time, team_match=None,
+                          team_ratio=0, runner_match=None, runner_ratio=0,
+                          runner_id=None, rating=None, status='review',
+                          reason=None) \
+                     for name, team, time in read_results(self.resultfile)]
+
+        ## Match teams, checking confirmed spellings first
+        team_names = list(set(row['team'] for row in self.rows))
+        team_aliases = TeamAlias.lookup(session, team_names)
+        try:
+            team_index = search.NameIndex((team, team.name) for team in \
+                                          Team.from_db(session, cached=True))
+        except QueryError:
+            team_index = search.NameIndex([])
+
+        team_matches = dict()
+        for team_name in team_names:
+            if team_name in team_aliases:
+                team_matches[team_name] = (team_aliases[team_name].name, 100)
+            elif len(team_index) > 0:
+                team, ratio = search.team_search(team_name, limit=1,
+                                                 index=team_index)[0]
+                team_matches[team_name] = (team.name, ratio)
+
+        for row in self.rows:
+            row['team_match'], row['team_ratio'] = \
+                team_matches.get(row['team'], (None, 0))
+            if row['team_ratio'] < self.team_threshold:
+                row['reason'] = 'team match below threshold'
+            else:
+                try:
+                    time_in_seconds(row['time'])
+                except (AttributeError, ValueError):
+                    row['reason'] = 'invalid time'
+
+        ## Match runners of accepted teams, checking confirmed spellings
+        ## first, then in one batch
+        rows = [row for row in self.rows if row['reason'] is None]
+        pairs = [(row['name'], row['team_match']) for row in rows]
+        runner_aliases = RunnerAlias.lookup(session, pairs,
+                                            gender=self.gender)
+        claimed = set(runner.id for runner in runner_aliases.values())
+
+        try:
+            runner_list = Runner.from_db(session,
+                                         team_list=list(set(team for name, team\
+                                                            in pairs)),
+                                         gender=self.gender, load_team=True)
+        except QueryError:
+            runner_list = []
+
+        new_pairs = [pair for pair in pairs if pair not in runner_aliases]
+        new_results = iter(search.batch_runner_search(
+            new_pairs, runner_list=[runner for runner in runner_list if \
+                                    runner.id not in claimed],
+            threshold=self.new_threshold, processes=processes))
+
+        seen = set()
+        for row, pair in zip(rows, pairs):
+            if pair in runner_aliases:
+                runner, ratio = runner_aliases[pair], 100
+            else:
+                runner, ratio = next(new_results)
+
+            ## Duplicate finishers would score one runner twice
+            key = runner.id if runner is not None else pair
+            if key in seen:
+                row['reason'] = 'duplicate runner'
+                continue
+            seen.add(key)
+
+            if runner is None and self.create_new:
+                row['runner_match'] = row['name']
+                row['status'] = 'new'
+                continue
+            elif runner is None:
+                row['reason'] = 'no runner match'
+                continue
+
+            row['runner_match'] = runner.name
+            row['runner_ratio'] = ratio
+            if ratio < self.runner_threshold:
+                row['reason'] = 'runner match below threshold'
+            else:
+                row['runner_id'] = runner.id
+                row['status'] = 'accepted'
+                if runner.status and runner.rating is not None:
+                    row['rating'] = float(runner.rating)
+
+        return self.rows
+
+    def calibrate(self, r200=None, tolerance=R200_TOLERANCE):
+        """Calibrate the 200 Speed Rating time from the accepted runners.
+
+        With fewer than MIN_CALIBRATION_SIZE rated runners within the
+        tolerance, the time is not calibrated and the race is not added
+        unless a time is given.
+
+        Args:
+            r200 (float, optional): Time in seconds to use instead of
+                calibrating. Defaults to 'None'.
+            tolerance (float, optional): Largest rating difference used.
+                Defaults to R200_TOLERANCE.
+
+        Returns:
+            Time in seconds for a Speed Rating of 200, or 'None' if it
+            could not be calibrated.
+        """
+
+        rated = [row for row in self.rows_with_status('accepted') \
+                 if row['rating'] is not None]
+        seconds = [time_in_seconds(row['time']) for row in rated]
+        ratings = [row['rating'] for row in rated]
+
+        if r200 is None:
+            r200, error, size = calibrate_r200(seconds, ratings,
+                                               self.distance, tolerance)
+            if size < MIN_CALIBRATION_SIZE:
+                r200 = None
+        else:
+            size = len(rated)
+
+        self.r200 = r200
+        self.calibration_size = size
+        if r200 is None:
+            self.error = None
+            return None
+
+        ## Error as shown by the update wizard
+        scale = SCALES[self.distance]
+        diffs = [rating - (200 - (time - r200)/scale) for time, rating in \
+                 zip(seconds, ratings)]
+
+        self.error = sum(diff**2 for diff in diffs if abs(diff) <= tolerance)
+
+        return self.r200
+
+    def commit(self, session):
+        """Add the accepted and new runners' results to the database.
+
+        New runners are added as inactive, confirmed spellings are stored
+        as aliases, and the race is processed with the calibrated time,
+        which activates the runners.
+
+        Args:
+            session (Session): Database session object.
+
+        Returns:
+            Race object added.
+
+        Raises:
+            ValueError: If the time is not calibrated.
+        """
+
+        if self.r200 is None:
+            raise ValueError('Race time is not calibrated.')
+
+        new = self.rows_with_status('new')
+        ids = Runner.bulk_upsert(session, [(row['runner_match'],
+                                            row['team_match'], self.gender) \
+                                           for row in new], status=False)
+        for runner_id, row in zip(ids, new):
+            row['runner_id'] = runner_id
+
+        rows = self.rows_with_status('accepted', 'new')
+
+        ## Remember confirmed spellings, so later files match them without
+        ## fuzzy search
+        teams = dict((row['team'], row['team_match']) for row in rows if \
+                     row['team_ratio'] == 100 and \
+                     row['team'] != row['team_match'])
+        TeamAlias.add(session, teams.items())
+        RunnerAlias.add(session, [(row['name'], row['runner_id']) for \
+                                  row in rows if row['runner_ratio'] == 100 \
+                                  and row['name'] != row['runner_match']])
+
+        results = [Result(name=self.name, date=self.date,
+                          distance=self.distance, rating=None,
+                          time=row['time'], runner_id=row['runner_id']) \
+                   for row in rows]
+
+        race = Race(self.name, self.date, self.distance, results,
+                    gender=self.gender, source=self.resultfile)
+        race.calculate_ratings(self.r200)
+        race.process(session)
+
+        return race
+
+    def write_report(self, directory):
+        """Write the rows held for review to a CSV file.
+
+        The file is named after the race, e.g. 'Race_M_Review.csv', and is
+        only written when rows are held.
+
+        Args:
+            directory (str): Output directory.
+
+        Returns:
+            Written filename, or 'None' if no rows are held.
+        """
+
+        rows = self.rows_with_status('review')
+        if len(rows) == 0:
+            return None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        filename = os.path.join(directory, '{0}_{1}_Review.csv'.format(
+            self.name, self.gender))
+        with open(filename, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.REPORT_FIELDS)
+            for row in rows:
+                writer.writerow([_format(row[field]) for field in \
+                                 self.REPORT_FIELDS])
+
+        return filename
@@ -0,0 +1,224 @@
+"""Schema migrations for use with NIRCAdb Package.
+
+This contains the versioned migrations that bring databases created by older
+versions of the package up to date with the current schema.  Tables that are
+missing entirely are created by SQLAlchemy, so only changes to existing
+tables are handled here.
+
+The schema version is stored in the SQLite user_version header.  Each
+migration step is applied in its own transaction together with the version
+bump, and every step checks the schema before changing it, so a database
+created by SQLAlchemy with the current models passes through the steps
+unchanged.
+
+"""
+
+################################################################################
+##
+## Modules and Packages
+##
+################################################################################
+
+import numpy as np
+
+import database
+import names
+
+################################################################################
+##
+## Migration Runner
+##
+################################################################################
+
+def schema_version(cursor):
+    """Return the schema version stored in the database."""
+
+    return cursor.execute('PRAGMA user_version').fetchone()[0]
+
+def upgrade(engine):
+    """Apply any migrations the database is missing.
+
+    Args:
+        engine (Engine): Engine bound to the database.
+
+    Returns:
+        Schema version of the database.
+    """
+
+    raw = engine.raw_connection()
+    dbapi_connection = raw.connection
+    isolation_level = dbapi_connection.isolation_level
+
+    ## Manage transactions explicitly, since the sqlite3 module would
+    ## otherwise commit before each ALTER or CREATE statement
+    dbapi_connection.isolation_level = None
+
+    try:
+        cursor = dbapi_connection.cursor()
+        version = schema_version(cursor)
+
+        while version < len(MIGRATIONS):
+
+            ## Re-read the version under the write lock, in case another
+            ## process applied the step first
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                version = schema_version(cursor)
+                if version < len(MIGRATIONS):
+                    MIGRATIONS[version](cursor)
+                    version += 1
+                    cursor.execute('PRAGMA user_version = {0}'.\
+                                   format(version))
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+        cursor.close()
+    finally:
+        dbapi_connection.isolation_level = isolation_level
+        raw.close()
+
+    return version
+
+def _columns(cursor, table):
+    """Return the column names of a table."""
+
+    return [row[1] for row in \
+            cursor.execute('PRAGMA table_info({0})'.format(table))]
+
+################################################################################
+##
+## Migration Steps
+##
+################################################################################
+
+def add_team_region(cursor):
+    """Add the region column missing from the 6.1 teams table."""
+
+    if 'region' not in _columns(cursor, 'teams'):
+        cursor.execute('ALTER TABLE teams ADD COLUMN region VARCHAR')
+
+def add_name_indexes(cursor):
+    """Add the name indexes declared on the runners and teams tables."""
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_runners_name '
+                   'ON runners (name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_teams_name '
+                   'ON teams (name)')
+
+def add_races_table(cursor):
+    """Move race information of existing results into the races table.
+
+    One race is created for each name, date, distance and gender found in
+    the results table, and its results are linked to it.  The r200 of each
+    race is recovered from the stored result times and ratings.
+    """
+
+    if 'race_id' in _columns(cursor, 'results'):
+        return
+
+    cursor.execute('ALTER TABLE results ADD COLUMN race_id INTEGER '
+                   'REFERENCES races (id)')
+
+    rows = cursor.execute('SELECT results.id, results.name, results.date, '
+                          'results.distance, results.time, results.rating, '
+                          'runners.gender '
+                          'FROM results LEFT OUTER JOIN runners '
+                          'ON runners.id = results.runner_id '
+                          'ORDER BY results.id').fetchall()
+
+    ## Group results by race, keeping the order races were processed in
+    races = dict()
+    order = []
+    for result_id, name, date, distance, time, rating, gender in rows:
+        key = (name, date, distance, gender)
+        if key not in races:
+            races[key] = ([], [])
+            order.append(key)
+        races[key][0].append(result_id)
+
+        ## Each processed result gives an estimate of the race r200
+        scale = database.SCALES.get(distance)
+        if scale is not None and rating is not None and time:
+            try:
+                seconds = database.time_in_seconds(time)
+            except ValueError:
+                continue
+            races[key][1].append(seconds - (200 - rating)*scale)
+
+    for key in order:
+        result_ids, estimates = races[key]
+        r200 = None
+        if len(estimates) > 0:
+            r200 = round(float(np.median(estimates)), 3)
+
+        cursor.execute('INSERT INTO races (name, date, distance, gender, r200) '
+                       'VALUES (?, ?, ?, ?, ?)', key + (r200,))
+        race_id = cursor.lastrowid
+        cursor.executemany('UPDATE results SET race_id = ? WHERE id = ?',
+                           [(race_id, result_id) for result_id in result_ids])
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_results_race_rating '
+                   'ON results (race_id, rating)')
+
+def add_runner_filter_index(cursor):
+    """Index the runner columns filtered on by Runner.from_db()."""
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_runners_team_gender_status '
+                   'ON runners (team_id, gender, status, rating)')
+
+def add_result_runner_index(cursor):
+    """Index results by runner for per-runner result lookups."""
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_results_runner_date '
+                   'ON results (runner_id, date)')
+
+def add_upsert_keys(cursor):
+    """Make team names and runner team, name and gender unique keys.
+
+    These are the conflict targets of Team.bulk_upsert() and 
+    Runner.bulk_upsert().  Creating the indexes fails if the database
+    already has duplicate teams or runners.
+    """
+
+    unique = dict((row[1], row[2]) for row in \
+                  cursor.execute('PRAGMA index_list(teams)'))
+    if not unique.get('ix_teams_name'):
+        cursor.execute('DROP INDEX IF EXISTS ix_teams_name')
+        cursor.execute('CREATE UNIQUE INDEX ix_teams_name ON teams (name)')
+
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS '
+                   'ix_runners_team_name_gender '
+                   'ON runners (team_id, name, gender)')
+
+def add_name_keys(cursor):
+    """Add and fill the indexed name key columns of the runners table."""
+
+    columns = _columns(cursor, 'runners')
+    for column in ['name_key', 'phonetic_key']:
+        if column not in columns:
+            cursor.execute('ALTER TABLE runners ADD COLUMN {0} VARCHAR'.\
+                           format(column))
+
+    rows = cursor.execute('SELECT id, name FROM runners '
+                          'WHERE name_key IS NULL').fetchall()
+    cursor.executemany('UPDATE runners SET name_key = ?, phonetic_key = ? '
+                       'WHERE id = ?',
+                       [(names.name_key(name or ''),
+                         names.phonetic_key(name or ''), runner_id) \
+                        for runner_id, name in rows])
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_runners_name_key '
+                   'ON runners (name_key)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_runners_phonetic_key '
+                   'ON runners (phonetic_key)')
+
+## Ordered migration steps; the schema version is the number applied
+MIGRATIONS = [add_team_region,
+              add_name_indexes,
+              add_races_table,
+              add_runner_filter_index,
+              add_result_runner_index,
+              add_upsert_keys,
+              add_name_keys]
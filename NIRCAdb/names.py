@@ -0,0 +1,145 @@
+"""Runner name keys for use with NIRCAdb Package.
+
+This contains the functions that reduce runner names to the keys stored in
+the runners table.  Names that differ only in case, punctuation, accents,
+word order, suffixes or a common nickname have the same normalized key, so
+they are matched by an exact lookup instead of fuzzy string matching.
+
+The phonetic key encodes each word of the normalized name with American
+Soundex, so names that sound alike, e.g. 'Jon Smyth' and 'John Smith', have
+the same phonetic key.
+
+"""
+
+################################################################################
+##
+## Modules and Packages
+##
+################################################################################
+
+import re
+import unicodedata
+
+## Groups of a given name and its diminutives.  Every name in a group is
+## keyed as the first name of the group; a name belongs to at most one group.
+## Only diminutives of a single given name of the same gender are grouped,
+## so different names never share a key
+NICKNAMES = [['abigail', 'abby', 'abbie'],
+             ['andrew', 'andy', 'drew'],
+             ['anthony', 'tony'],
+             ['benjamin', 'ben', 'benji', 'benny'],
+             ['charles', 'charlie', 'chuck'],
+             ['christopher', 'chris'],
+             ['daniel', 'dan', 'danny'],
+             ['david', 'dave', 'davey'],
+             ['edward', 'ed', 'eddie', 'ned'],
+             ['elizabeth', 'liz', 'lizzie', 'lizzy', 'beth', 'betsy', 'libby',
+              'betty'],
+             ['gregory', 'greg'],
+             ['jacob', 'jake'],
+             ['james', 'jim', 'jimmy'],
+             ['jennifer', 'jen', 'jenn', 'jenny'],
+             ['jessica', 'jess'],
+             ['john', 'johnny'],
+             ['jonathan', 'jon', 'jonny'],
+             ['joseph', 'joe', 'joey'],
+             ['joshua', 'josh'],
+             ['katherine', 'kate', 'katie', 'kathy'],
+             ['kenneth', 'ken', 'kenny'],
+             ['margaret', 'maggie', 'meg', 'peggy'],
+             ['matthew', 'matt', 'matty'],
+             ['michael', 'mike', 'mikey', 'mick', 'mickey'],
+             ['nicholas', 'nick'],
+             ['patrick', 'pat'],
+             ['peter', 'pete'],
+             ['rebecca', 'becca', 'becky'],
+             ['richard', 'rich', 'rick', 'ricky', 'richie'],
+             ['robert', 'rob', 'robbie', 'bob', 'bobby'],
+             ['samuel', 'sam', 'sammy'],
+             ['stephen', 'steve', 'stevie'],
+             ['susan', 'sue', 'susie'],
+             ['theodore', 'theo'],
+             ['thomas', 'tom', 'tommy'],
+             ['timothy', 'tim', 'timmy'],
+             ['victoria', 'vicky', 'tori'],
+             ['william', 'will', 'bill', 'billy', 'willy', 'willie'],
+             ['zachary', 'zach', 'zack', 'zak']]
+
+## Words dropped from names, as they are often left out of results
+SUFFIXES = set(['jr', 'sr', 'ii', 'iii', 'iv'])
+
+## American Soundex digit of each consonant
+SOUNDEX_CODES = dict((letter, str(digit)) for digit, letters in \
+                     enumerate(['bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'], 1) \
+                     for letter in letters)
+
+_canonical = dict((name, group[0]) for group in NICKNAMES for name in group)
+_separator = re.compile(r'[^a-z0-9]+')
+
+################################################################################
+##
+## Name Key Functions
+##
+################################################################################
+
+def _words(name):
+    """Split a name into normalized words.
+
+    Accents are removed, letters are lowercased, and a name written as
+    'Last, First' is reordered to 'First Last'.
+    """
+
+    if isinstance(name, str):
+        name = name.decode('utf-8', 'replace')
+
+    name = unicodedata.normalize('NFKD', name)
+    name = u''.join(c for c in name if not unicodedata.combining(c)).lower()
+
+    parts = name.split(',')
+    if len(parts) == 2:
+        name = u'{0} {1}'.format(parts[1], parts[0])
+
+    return [word for word in _separator.split(name.encode('ascii', 'ignore'))
+            if word and word not in SUFFIXES]
+
+def soundex(word):
+    """Return the American Soundex code of a word."""
+
+    code = word[0]
+    last = SOUNDEX_CODES.get(word[0])
+    for letter in word[1:]:
+        digit = SOUNDEX_CODES.get(letter)
+        if digit is not None and digit != last:
+            code += digit
+        if letter not in 'hw':
+            last = digit
+
+    return (code + '000')[:4]
+
+def name_key(name):
+    """Return the normalized key of a runner name.
+
+    Words are normalized, nicknames replaced by their group name and the
+    words sorted, so word order does not matter.
+
+    Args:
+        name (str): Runner name.
+
+    Returns:
+        Normalized key (str).
+    """
+
+    return ' '.join(sorted(_canonical.get(word, word) for word in \
+                           _words(name)))
+
+def phonetic_key(name):
+    """Return the phonetic key of a runner name.
+
+    Args:
+        name (str): Runner name.
+
+    Returns:
+        Sorted Soundex codes (str) of the words of the normalized key.
+    """
+
+    return ' '.join(sorted(soundex(word) for word in name_key(name).split()))
@@ -0,0 +1,353 @@
+"""Weekly ranking objects for use with NIRCAdb Package.
+
+This contains the objects that build the weekly runner and team rankings
+for a season.  Every weekly snapshot for both genders is built in a single
+pass over the rating history, and can be exported to CSV, JSON and HTML.
+
+"""
+
+################################################################################
+##
+## Modules and Packages
+##
+################################################################################
+
+import bisect
+import cgi
+import csv
+import datetime
+import heapq
+import json
+import os
+
+import numpy as np
+
+from database import Runner, Team, RatingHistory
+from export import _format
+from snapshot import Snapshot
+
+################################################################################
+##
+## Helper Functions
+##
+################################################################################
+
+def week_cutoffs(race_dates):
+    """Determine the weekly ranking cutoffs for a list of race dates.
+
+    Each race is ranked in the week ending on the Sunday on or after the
+    race date.
+
+    Args:
+        race_dates (list): List of race dates (Date).
+
+    Returns:
+        Sorted list of unique cutoff dates.
+    """
+
+    cutoffs = set()
+    for date in race_dates:
+        cutoffs.add(date + datetime.timedelta(days=6-date.weekday()))
+
+    return sorted(cutoffs)
+
+################################################################################
+##
+## Rankings Object
+##
+################################################################################
+
+class Rankings:
+    """Represents the weekly runner and team rankings for a season.
+
+    Attributes:
+        dates (list): List of weekly cutoff dates.
+        team_size (int): Number of runners scored for a team.
+        snapshots (list): List of weekly snapshots as dictionaries, ordered
+            by week then gender.  Empty until generate() is called.
+    """
+
+    RUNNER_FIELDS = ['rank', 'region_rank', 'name', 'team', 'region',
+                     'rating']
+    TEAM_FIELDS = ['rank', 'region_rank', 'team', 'region', 'score',
+                   'runners']
+
+    def __init__(self, dates, team_size=5):
+
+        self.dates = sorted(dates)
+        self.team_size = team_size
+        self.snapshots = []
+
+    def generate(self, source):
+        """Build the snapshots for every week and gender in one pass.
+
+        Rating history rows are read once in date order.  For each gender
+        the ordered runner list and the team scores are updated in place
+        as rows are read, and only teams with a changed runner are
+        rescored when a week is closed.
+
+        Args:
+            source (Session or Snapshot): Database session object, or a
+                columnar snapshot of the database.
+
+        Returns:
+            List of snapshots.
+        """
+
+        if isinstance(source, Snapshot):
+            rows = self._snapshot_rows(source)
+        else:
+            rows = source.query(RatingHistory.date, RatingHistory.result_id,
+                                RatingHistory.runner_id,
+                                RatingHistory.rating_after, Runner.name,
+                                Runner.gender, Team.name, Team.region).\
+                   join(Runner, Runner.id == RatingHistory.runner_id).\
+                   outerjoin(Team, Team.id == Runner.team_id).\
+                   order_by(RatingHistory.date, RatingHistory.result_id).\
+                   yield_per(1000)
+
+        states = dict((gender, _GenderState(self.team_size)) \
+                      for gender in ['M', 'W'])
+        self.snapshots = []
+
+        week = 0
+        for row in rows:
+            (date, result_id, runner_id, rating, name, gender,
+             team, region) = row
+
+            ## Close every week that ends before this row
+            while week < len(self.dates) and date > self.dates[week]:
+                self._close_week(week, states)
+                week += 1
+            if week == len(self.dates):
+                break
+
+            if gender in states:
+                states[gender].update(result_id, runner_id, rating, name,
+                                      team, region)
+
+        while week < len(self.dates):
+            self._close_week(week, states)
+            week += 1
+
+        return self.snapshots
+
+    @staticmethod
+    def _snapshot_rows(snapshot):
+        """Yield rating history rows of a snapshot in date order."""
+
+        history = snapshot.rating_history
+        runners = snapshot.runners
+        teams = snapshot.teams
+
+        order = np.lexsort((history['result_id'], history['date']))
+
+        ## Exported tables are ordered by id, so rows are found by bisection
+        runner_rows = np.searchsorted(runners['id'],
+                                      history['runner_id'][order])
+        runner_rows = np.minimum(runner_rows, len(runners['id']) - 1)
+        team_ids = runners['team_id'][runner_rows]
+        team_rows = np.minimum(np.searchsorted(teams['id'], team_ids),
+                               len(teams['id']) - 1)
+        has_team = teams['id'][team_rows] == team_ids
+
+        dates = history['date'][order].astype(object)
+        for i, j in enumerate(order):
+            runner = runner_rows[i]
+            if runners['id'][runner] != history['runner_id'][j]:
+                continue
+
+            team = region = None
+            if has_team[i]:
+                team = teams['name'][team_rows[i]]
+                region = teams['region'][team_rows[i]] or None
+
+            yield (dates[i], int(history['result_id'][j]),
+                   int(history['runner_id'][j]),
+                   float(history['rating_after'][j]),
+                   runners['name'][runner], runners['gender'][runner],
+                   team, region)
+
+    def _close_week(self, week, states):
+        """Append the snapshots of a week for each gender."""
+
+        for gender in ['M', 'W']:
+            runners, teams = states[gender].snapshot()
+            self.snapshots.append({'week': week + 1,
+                                   'date': self.dates[week],
+                                   'gender': gender,
+                                   'runners': runners,
+                                   'teams': teams})
+
+    def export(self, directory, formats=['csv', 'json', 'html']):
+        """Write every snapshot to files.
+
+        Files are named after the published rankings, e.g.
+        'Rankings Week 1 - M.csv' and 'Team Rankings Week 1 - M.csv'.
+
+        Args:
+            directory (str): Output directory.
+            formats (list, optional): Output formats, any of 'csv', 'json'
+                and 'html'. Defaults to all three.
+
+        Returns:
+            List of written filenames.
+        """
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        filenames = []
+        for snapshot in self.snapshots:
+            base = 'Rankings Week {0} - {1}'.format(snapshot['week'],
+                                                    snapshot['gender'])
+
+            for fmt in formats:
+                if fmt == 'csv':
+                    filenames.append(self._write_csv(
+                        os.path.join(directory, base + '.csv'),
+                        self.RUNNER_FIELDS, snapshot['runners']))
+                    filenames.append(self._write_csv(
+                        os.path.join(directory, 'Team ' + base + '.csv'),
+                        self.TEAM_FIELDS, snapshot['teams']))
+                elif fmt == 'json':
+                    filenames.append(self._write_json(
+                        os.path.join(directory, base + '.json'), snapshot))
+                elif fmt == 'html':
+                    filenames.append(self._write_html(
+                        os.path.join(directory, base + '.html'), base,
+                        snapshot))
+                else:
+                    raise KeyError("'{0}' is not a valid format.".format(fmt))
+
+        return filenames
+
+    def _write_csv(self, filename, fields, rows):
+
+        with open(filename, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow([_format(row[field]) for field in fields])
+
+        return filename
+
+    def _write_json(self, filename, snapshot):
+
+        output = dict(snapshot)
+        output['date'] = snapshot['date'].isoformat()
+
+        with open(filename, 'w') as f:
+            json.dump(output, f, indent=1)
+
+        return filename
+
+    def _write_html(self, filename, title, snapshot):
+
+        lines = ['<html>', '<head><title>{0}</title></head>'.format(title),
+                 '<body>', '<h1>{0}</h1>'.format(title),
+                 '<p>Results through {0}</p>'.format(snapshot['date'])]
+
+        for header, fields, rows in [('Teams', self.TEAM_FIELDS,
+                                      snapshot['teams']),
+                                     ('Runners', self.RUNNER_FIELDS,
+                                      snapshot['runners'])]:
+            lines.append('<h2>{0}</h2>'.format(header))
+            lines.append('<table>')
+            lines.append('<tr>' + ''.join('<th>{0}</th>'.format(field) \
+                                          for field in fields) + '</tr>')
+            for row in rows:
+                lines.append('<tr>' + ''.join(
+                    '<td>{0}</td>'.format(cgi.escape(_format(row[field]))) \
+                    for field in fields) + '</tr>')
+            lines.append('</table>')
+
+        lines += ['</body>', '</html>']
+
+        with open(filename, 'w') as f:
+            f.write('\n'.join(lines))
+
+        return filename
+
+################################################################################
+##
+## Incremental Ranking State
+##
+################################################################################
+
+class _GenderState:
+    """Incrementally maintained rankings for a single gender."""
+
+    def __init__(self, team_size):
+
+        self.team_size = team_size
+
+        ## runner id -> (result id, rating, name, team, region)
+        self.runners = dict()
+
+        ## Runners ordered by rating as sorted (-rating, name, id) keys
+        self.order = []
+
+        ## team -> {runner id: (rating, name)}, plus teams needing rescoring
+        self.team_runners = dict()
+        self.team_regions = dict()
+        self.team_scores = dict()
+        self.dirty = set()
+
+    def update(self, result_id, runner_id, rating, name, team, region):
+
+        ## A result processed earlier than the current one is superseded
+        current = self.runners.get(runner_id)
+        if current is not None:
+            if current[0] > result_id:
+                return
+            key = (-current[1], current[2], runner_id)
+            del self.order[bisect.bisect_left(self.order, key)]
+            self.team_runners[current[3]].pop(runner_id, None)
+            self.dirty.add(current[3])
+
+        self.runners[runner_id] = (result_id, rating, name, team, region)
+        bisect.insort(self.order, (-rating, name, runner_id))
+
+        self.team_runners.setdefault(team, dict())[runner_id] = (rating, name)
+        self.team_regions[team] = region
+        self.dirty.add(team)
+
+    def snapshot(self):
+
+        ## Rescore only teams that changed since the last snapshot
+        for team in self.dirty:
+            scorers = heapq.nlargest(self.team_size,
+                                     self.team_runners[team].values())
+            if team is not None and len(scorers) == self.team_size:
+                score = sum(rating for rating, name in scorers)/\
+                        float(self.team_size)
+                self.team_scores[team] = (round(score, 3),
+                                          [name for rating, name in scorers])
+            else:
+                self.team_scores.pop(team, None)
+        self.dirty = set()
+
+        runners = []
+        region_counts = dict()
+        for i, (rating, name, runner_id) in enumerate(self.order):
+            result_id, rating, name, team, region = self.runners[runner_id]
+            region_counts[region] = region_counts.get(region, 0) + 1
+            runners.append({'rank': i + 1,
+                            'region_rank': region_counts[region],
+                            'name': name, 'team': team, 'region': region,
+                            'rating': rating})
+
+        teams = []
+        region_counts = dict()
+        ordered = sorted(self.team_scores.iteritems(),
+                         key=lambda x: (-x[1][0], x[0]))
+        for i, (team, (score, names)) in enumerate(ordered):
+            region = self.team_regions[team]
+            region_counts[region] = region_counts.get(region, 0) + 1
+            teams.append({'rank': i + 1,
+                          'region_rank': region_counts[region],
+                          'team': team, 'region': region, 'score': score,
+                          'runners': names})
+
+        return runners, teams
@@ -12,9 +12,272 @@ match runners in the database to string queries.
 ##
 ################################################################################
 
-from fuzzywuzzy import fuzz, process
+import collections
+import multiprocessing
+
+import numpy as np
+from fuzzywuzzy import fuzz, process, utils
+from scipy.optimize import linear_sum_assignment
 
 from database import Team, Runner
+from cache import query_cache
+from errors import QueryError
+from names import name_key, phonetic_key
+
+## Minimum number of candidates scored by fuzzy matching per search
+CANDIDATE_SIZE = 50
+
+## Number of candidates per name scored by fuzzy matching in batch searches
+BATCH_CANDIDATE_SIZE = 5
+
+## Lowest ratio of a batch search match; worse names are left unmatched
+MATCH_THRESHOLD = 70
+
+## Ratio of a match by name key only, when the names differ once processed.
+## Below 100, so these matches are confirmed and never stored as aliases
+KEY_RATIO = 95
+
+################################################################################
+##
+## Name Index Object
+##
+################################################################################
+
+def _trigrams(name):
+    """Return the set of word trigrams of a name.
+
+    Names are processed like fuzzy matching choices, and each word is padded
+    with spaces, so word order does not matter and word boundaries count.
+    """
+
+    trigrams = set()
+    for word in utils.full_process(name).split():
+        word = ' {0} '.format(word)
+        for i in range(len(word) - 2):
+            trigrams.add(word[i:i + 3])
+
+    return trigrams
+
+class NameIndex(object):
+    """Represents a trigram inverted index of names.
+
+    Searches only score the names sharing the most trigrams with the search
+    name, instead of every name.  Each lookup reads the postings of the 
+    search trigrams, so its cost depends on how common those trigrams are,
+    not on the number of names.
+
+    Attributes:
+        entries (list): Indexed (value, name) tuples.
+    """
+
+    def __init__(self, entries):
+
+        self.entries = list(entries)
+        self._postings = collections.defaultdict(list)
+        for i, (value, name) in enumerate(self.entries):
+            for trigram in _trigrams(name):
+                self._postings[trigram].append(i)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def candidates(self, name_search, size=CANDIDATE_SIZE):
+        """Return the entries sharing the most trigrams with a name.
+
+        Args:
+            name_search (str): Name to search for.
+            size (int, optional): Maximum number of candidates. Defaults to
+                CANDIDATE_SIZE.
+
+        Returns:
+            List of at most 'size' (value, name) tuples.  Every entry is 
+            returned if there are no more than 'size'.
+        """
+
+        if len(self.entries) <= size:
+            return self.entries
+
+        counts = collections.Counter()
+        for trigram in _trigrams(name_search):
+            counts.update(self._postings.get(trigram, ()))
+
+        return [self.entries[i] for i, count in counts.most_common(size)]
+
+def _database_index(session, cls):
+    """Return the cached (id, name) index of the runners or teams table."""
+
+    key = ('name_index', cls.__tablename__)
+    return query_cache.get(session, key, lambda s: [NameIndex(
+        s.query(cls.id, cls.name).order_by(cls.id))])[0]
+
+def _search(name_search, limit, index):
+    """Score the index candidates of a name, returning (value, ratio)."""
+
+    candidates = index.candidates(name_search, max(CANDIDATE_SIZE, limit))
+
+    ## Names sharing no trigrams are only scored if nothing better exists
+    if len(candidates) < limit:
+        candidates = index.entries
+
+    choices = dict((i, name) for i, (value, name) in enumerate(candidates))
+    matches = process.extract(name_search, choices, limit=limit)
+
+    search_results = [(candidates[i][0], ratio) for name, ratio, i in matches]
+    search_results.sort(key=lambda x: x[1], reverse=True)
+
+    return search_results
+
+def _prepare(name):
+    """Process a name the way process.extract() does before scoring."""
+
+    return utils.full_process(utils.full_process(name), force_ascii=True)
+
+def _keys(name, runner=None):
+    """Return the processed name, name key and phonetic key of a name.
+
+    The keys stored for a runner are used when it has them.
+    """
+
+    if runner is not None and runner.name_key is not None:
+        return (_prepare(name), runner.name_key, runner.phonetic_key)
+
+    return (_prepare(name), name_key(name), phonetic_key(name))
+
+def _trigram_matrix(queries, choices):
+    """Return the trigram Dice coefficient of every query and choice.
+
+    Both are encoded as rows of a binary matrix over their trigrams, so the
+    shared trigrams of every pair come from one matrix product.
+    """
+
+    query_trigrams = [_trigrams(query) for query in queries]
+    choice_trigrams = [_trigrams(choice) for choice in choices]
+
+    columns = dict()
+    for trigrams in query_trigrams + choice_trigrams:
+        for trigram in trigrams:
+            columns.setdefault(trigram, len(columns))
+
+    def encode(trigram_sets):
+        matrix = np.zeros((len(trigram_sets), max(len(columns), 1)))
+        for i, trigrams in enumerate(trigram_sets):
+            matrix[i, [columns[trigram] for trigram in trigrams]] = 1
+        return matrix
+
+    query_matrix = encode(query_trigrams)
+    choice_matrix = encode(choice_trigrams)
+    sizes = query_matrix.sum(axis=1)[:, None] + choice_matrix.sum(axis=1)
+
+    return 2*query_matrix.dot(choice_matrix.T)/np.maximum(sizes, 1)
+
+def _score_matrix(queries, choices):
+    """Return the WRatio of the candidate choices of every query.
+
+    Queries and choices are (processed name, name key, phonetic key) 
+    tuples.  Queries with the name key of a choice only score the choices
+    with that key, at 100 for the same processed name and KEY_RATIO
+    otherwise.  Other queries score the BATCH_CANDIDATE_SIZE
+    choices with the highest trigram Dice coefficient and the choices with
+    the same phonetic key, once per distinct query.  Choices not scored 
+    are -1.
+    """
+
+    scores = np.full((len(queries), len(choices)), -1, dtype=int)
+
+    exact = collections.defaultdict(list)
+    phonetic = collections.defaultdict(list)
+    for column, (choice, key, sound) in enumerate(choices):
+        exact[key].append(column)
+        phonetic[sound].append(column)
+
+    distinct = sorted(set(query for query in queries if query[1] not in exact))
+    ratios = dict()
+    if len(distinct) > 0:
+        similarity = _trigram_matrix(
+            [query for query, key, sound in distinct],
+            [choice for choice, key, sound in choices])
+        candidates = np.argsort(-similarity, axis=1, kind='mergesort')
+        for query, columns in zip(distinct,
+                                  candidates[:, :BATCH_CANDIDATE_SIZE]):
+            columns = sorted(set(columns) | set(phonetic.get(query[2], [])))
+            ratios[query] = [(column, fuzz.WRatio(query[0],
+                                                  choices[column][0],
+                                                  full_process=False)) \
+                             for column in columns]
+
+    for row, query in enumerate(queries):
+        if query[1] in exact:
+            for column in exact[query[1]]:
+                scores[row, column] = 100 if query[0] == choices[column][0] \
+                                      else KEY_RATIO
+        else:
+            for column, ratio in ratios[query]:
+                scores[row, column] = ratio
+
+    return scores
+
+def _assign(scores, threshold):
+    """Assign each row of a score matrix to a different column.
+
+    Rows whose best score is below the threshold are left unmatched.  If
+    several rows share the same best column, the rows are assigned by
+    solving the assignment problem maximizing the total score, with a 
+    column per row scoring just below the threshold for leaving it 
+    unmatched.
+
+    Returns:
+        List of the column (int) of each row, None if unmatched.
+    """
+
+    rows = np.arange(len(scores))
+    columns = scores.argmax(axis=1)
+    matched = scores[rows, columns] >= threshold
+
+    ## The best column of each row is optimal when no column is shared
+    if len(set(columns[matched])) == matched.sum():
+        return [int(column) if match else None for column, match in \
+                zip(columns, matched)]
+
+    size = scores.shape[1]
+    costs = np.hstack([-scores.astype(float),
+                       np.full((len(scores), len(scores)), 0.5 - threshold)])
+    rows, columns = linear_sum_assignment(costs)
+
+    assigned = [None]*len(scores)
+    for row, column in zip(rows, columns):
+        if column < size:
+            assigned[row] = int(column)
+
+    return assigned
+
+def _match_block(job):
+    """Match the names of one team to its runner names.
+
+    Jobs hold only processed name lists, so they are cheap to send to
+    worker processes.
+
+    Args:
+        job (tuple): Names searched and runner names, as (processed name,
+            name key, phonetic key) tuples, and the threshold of a match.
+
+    Returns:
+        List of (column, ratio) tuples of each name, None if unmatched.
+    """
+
+    queries, choices, threshold = job
+    scores = _score_matrix(queries, choices)
+
+    return [None if column is None else (column, int(scores[row, column])) \
+            for row, column in enumerate(_assign(scores, threshold))]
+
+def _load(session, cls, search_results):
+    """Replace the ids of search results with objects from the database."""
+
+    ids = [value for value, ratio in search_results]
+    objects = dict((obj.id, obj) for obj in \
+                   session.query(cls).filter(cls.id.in_(ids)))
+
+    return [(objects[value], ratio) for value, ratio in search_results]
 
 ################################################################################
 ##
@@ -25,89 +288,192 @@ from database import Team, Runner
 def team_search(name_search, limit=3, **kwargs):
     """Search database for a team by team name.
 
+    Only the candidates of a trigram index are scored.  The index of the
+    database teams is cached until the teams change.
+
     Args:
-        session (Session): Database session object.
         name_search (str): Team name to search for.
-        threshold (int, optional): Levenshtein ratio cutoff.  Defaults to 
-            80.
+        limit (int, optional): Maximum number of results. Defaults to 3.
+        session (Session): Database session object.
+        team_list (list): Team objects to search instead of the database.
+        index (NameIndex): Index of (Team, name) tuples to search instead
+            of the database, reused across searches.
 
     Returns:
-        Team object from database that matches the name.
+        List of (Team, ratio) tuples ordered by Levenshtein ratio.
 
     Raises:
-        SearchError: If no match above 'threshold' is found.
+        TypeError: If no session, team_list or index is given.
     """
 
     ## Query database or use provided team list
-    session = None
-    team_list = None
-    if "team_list" in kwargs:
-        team_list = kwargs['team_list']
+    if "index" in kwargs:
+        return _search(name_search, limit, kwargs['index'])
+    elif "team_list" in kwargs:
+        index = NameIndex((team, team.name) for team in kwargs['team_list'])
+        return _search(name_search, limit, index)
     elif "session" in kwargs:
         session = kwargs['session']
-        team_list = Team.from_db(session)
+        search_results = _search(name_search, limit,
+                                 _database_index(session, Team))
+        return _load(session, Team, search_results)
     else:
-        raise TypeError('Must provided either session=' +
-                        'or team_list= parameters')
-    
-    ## Look for matches for the team
-    choices = [team.name for team in team_list]
-    matches = process.extract(name_search, choices, limit=limit)
+        raise TypeError('Must provided either session=, ' +
+                        'team_list= or index= parameters')
 
-    ## Get corresponding Team object for the results
-    search_results = []
-    for match in matches:
-        for team in team_list:
-            if team.name == match[0]:
-                search_results.append((team, match[1]))
+def runner_search(name_search, limit=5, **kwargs):
+    """Search database for a runner by runner name.
 
-    ## Sort results
-    search_results.sort(key=lambda x: x[1], reverse=True)
-    return search_results
+    Only the candidates of a trigram index are scored.  The index of the
+    database runners is cached until the runners change.  Database runners
+    of the given gender and team with the normalized name key of the name
+    are returned without fuzzy search, with ratio 100 if their processed
+    names are the same and KEY_RATIO otherwise.
 
-def runner_search(name_search, limit=5, **kwargs):
-    """Search database for a team by team name.
+    Args:
+        name_search (str): Runner name to search for.
+        limit (int, optional): Maximum number of results. Defaults to 5.
+        session (Session): Database session object.
+        runner_list (list): Runner objects to search instead of the 
+            database.
+        index (NameIndex): Index of (Runner, name) tuples to search instead
+            of the database, reused across searches.
+        gender (str, optional): Gender of runners matched by name key in
+            the database. Defaults to 'None'.
+        team (str, optional): Team name of runners matched by name key in
+            the database. Defaults to 'None'.
+
+    Returns:
+        List of (Runner, ratio) tuples ordered by Levenshtein ratio.
+
+    Raises:
+        TypeError: If no session, runner_list or index is given.
+    """
+
+    ## Query database or use provided runner list
+    if "index" in kwargs:
+        return _search(name_search, limit, kwargs['index'])
+    elif "runner_list" in kwargs:
+        index = NameIndex((runner, runner.name) for runner in \
+                          kwargs['runner_list'])
+        return _search(name_search, limit, index)
+    elif "session" in kwargs:
+        session = kwargs['session']
+
+        ## Names with the normalized key of a runner need no fuzzy search
+        key = name_key(name_search)
+        if key:
+            query = session.query(Runner).filter(Runner.name_key == key)
+            if kwargs.get('gender') in ['M', 'W']:
+                query = query.filter(Runner.gender == kwargs['gender'])
+            if kwargs.get('team') is not None:
+                query = query.join(Team, Team.id == Runner.team_id).\
+                        filter(Team.name == kwargs['team'])
+            runners = query.order_by(Runner.id).limit(limit).all()
+            if len(runners) > 0:
+                processed = _prepare(name_search)
+                search_results = [(runner, 100 if _prepare(runner.name) == \
+                                   processed else KEY_RATIO) \
+                                  for runner in runners]
+                return sorted(search_results, key=lambda x: -x[1])
+
+        search_results = _search(name_search, limit,
+                                 _database_index(session, Runner))
+        return _load(session, Runner, search_results)
+    else:
+        raise TypeError('Must provided either session=, ' +
+                        'runner_list= or index= parameters')
+
+def batch_runner_search(pairs, **kwargs):
+    """Match every (name, team) pair of a results file at once.
+
+    Pairs are blocked by team name, and each team's runner names are
+    processed once.  Names with the normalized name key of a runner score
+    100 without fuzzy matching if the processed names are the same, and
+    KEY_RATIO otherwise.  For the other distinct names searched on each
+    team, a trigram similarity matrix against the team's runners is
+    built, and only the BATCH_CANDIDATE_SIZE most similar runners of each
+    name, and the runners with the same phonetic key, are scored by fuzzy
+    matching.
+
+    Each team's names are then assigned to different runners, maximizing
+    the total ratio, so two finishers are never matched to the same runner.
+    Names whose best available ratio is below the threshold are left 
+    unmatched, as new runners.
 
     Args:
+        pairs (list): Runner name and team name (str) tuples to search for.
         session (Session): Database session object.
-        name_search (str): Runner name to search for.
-        team_name (str, optional): Team name for team filter in query.
-            Defaults to None.
-        thershold (int, optional): Levenshtein ratio cutoff.  Defaults to
-            70.
+        runner_list (list): Runner objects, with their teams loaded, to 
+            search instead of the database.
+        gender (str, optional): Gender of runners searched in the database.
+            Defaults to 'None'.
+        threshold (int, optional): Lowest ratio of a match. Defaults to
+            MATCH_THRESHOLD.
+        processes (int, optional): Number of worker processes the teams are
+            matched in. Results do not depend on it. Defaults to 1,
+            matching in the calling process.
 
     Returns:
-        Runner object from database that matches the name.
+        List of (Runner, ratio) tuples in the order of the pairs, with 
+        (None, 0) for pairs left unmatched.
 
     Raises:
-        SearchError: If no match above 'threshold' is found.
+        TypeError: If no session or runner_list is given.
     """
 
-    ## Query database or use provided team list
-    session = None
-    runner_list = None
+    threshold = kwargs.get('threshold', MATCH_THRESHOLD)
+    processes = kwargs.get('processes', 1)
+
+    ## Query database or use provided runner list
     if "runner_list" in kwargs:
         runner_list = kwargs['runner_list']
     elif "session" in kwargs:
-        session = kwargs['session']
-        runner_list = Runner.from_db(session)
+        team_list = list(set(team for name, team in pairs))
+        try:
+            runner_list = Runner.from_db(kwargs['session'],
+                                         team_list=team_list,
+                                         gender=kwargs.get('gender'),
+                                         load_team=True)
+        except QueryError:
+            runner_list = []
     else:
-        raise TypeError('Must provided either session=' +
+        raise TypeError('Must provided either session= ' +
                         'or runner_list= parameters')
-    
-    ## Look for matches for the team
-    choices = [runner.name for runner in runner_list]
-    matches = process.extract(name_search, choices, limit=limit)
 
-    ## Get corresponding Team object for the results
-    search_results = []
-    for match in matches:
-        for runner in runner_list:
-            if runner.name == match[0]:
-                search_results.append((runner, match[1]))
+    ## Block runners and the searched pairs by team
+    team_runners = collections.defaultdict(list)
+    for runner in runner_list:
+        team_runners[runner.team.name].append(runner)
+
+    team_rows = collections.defaultdict(list)
+    for i, (name, team) in enumerate(pairs):
+        team_rows[team].append(i)
+
+    ## One job per team with runners, largest first to balance workers
+    teams = sorted([team for team in team_rows if team_runners.get(team)],
+                   key=lambda team: (-len(team_rows[team]), team))
+    jobs = [([_keys(pairs[i][0]) for i in team_rows[team]],
+             [_keys(runner.name, runner) for runner in team_runners[team]],
+             threshold) for team in teams]
+
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            matches = pool.map(_match_block, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        matches = [_match_block(job) for job in jobs]
+
+    search_results = [(None, 0)]*len(pairs)
+    for team, team_matches in zip(teams, matches):
+        runners = team_runners[team]
+        for i, match in zip(team_rows[team], team_matches):
+            if match is not None:
+                search_results[i] = (runners[match[0]], match[1])
 
-    ## Sort results
-    search_results.sort(key=lambda x: x[1], reverse=True)
     return search_results
 
 ################################################################################
@@ -4,6 +4,8 @@ This contains the objects that control the simulation processes.
 
 """
 
+import numpy as np
+
 from database import Team, Runner
 
 ################################################################################
@@ -45,6 +47,101 @@ class Sim:
 
         self._is_simulated = False
 
+    @classmethod
+    def from_db(cls, session, gender='M', names=[], regions=[]):
+        """Initialize a Sim from teams in the database.
+
+        Only the seven highest rated active runners of the given gender are
+        loaded for each team, ranked by the database in the same query as
+        the teams, so building and running the Sim issues no further 
+        queries.
+
+        Args:
+            session (Session): Database session object.
+            gender (str, optional): Gender of the race. Defaults to 'M'.
+            names (list, optional): Team name(s) (str) to filter by. 
+                Defaults to empty list.
+            regions (list, optional): Region(s) (str) to filter by.
+                Defaults to empty list.
+
+        Returns:
+            Sim object.
+        """
+
+        teams = Team.from_db(session, names=names, regions=regions,
+                             load_runners=True, gender=gender, status=True,
+                             top=7)
+
+        return cls(teams, gender)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, gender='M', names=[], regions=[]):
+        """Initialize a Sim from a columnar database snapshot.
+
+        Scorers are selected with array operations, and Team and Runner
+        objects are only created for the top seven runners of each team
+        with at least five active runners.
+
+        Args:
+            snapshot (Snapshot): Snapshot of the database.
+            gender (str, optional): Gender of the race. Defaults to 'M'.
+            names (list, optional): Team name(s) (str) to filter by. 
+                Defaults to empty list.
+            regions (list, optional): Region(s) (str) to filter by.
+                Defaults to empty list.
+
+        Returns:
+            Sim object.
+        """
+
+        if not isinstance(names, list):
+            names = [names]
+        if not isinstance(regions, list):
+            regions = [regions]
+
+        teams = snapshot.teams
+        runners = snapshot.runners
+
+        ## Select teams using the name and region filters
+        team_mask = np.ones(len(teams['id']), dtype=bool)
+        if len(names) > 0:
+            team_mask &= np.in1d(teams['name'], names)
+        if len(regions) > 0:
+            team_mask &= np.in1d(teams['region'], regions)
+
+        ## Active runners of the gender, sorted by team then rating
+        mask = (runners['gender'] == gender) & runners['status'] & \
+               ~np.isnan(runners['rating']) & \
+               np.in1d(runners['team_id'], teams['id'][team_mask])
+        rows = np.nonzero(mask)[0]
+        rows = rows[np.lexsort((-runners['rating'][rows],
+                                runners['team_id'][rows]))]
+
+        team_rows = snapshot.team_index()
+        team_ids, starts, counts = np.unique(runners['team_id'][rows],
+                                             return_index=True,
+                                             return_counts=True)
+
+        sim_teams = []
+        for team_id, start, count in zip(team_ids, starts, counts):
+            if count < 5:
+                continue
+
+            row = team_rows[team_id]
+            team = Team(name=teams['name'][row], region=teams['region'][row])
+            for i in rows[start:start + min(count, 7)]:
+                runner = Runner(id=int(runners['id'][i]),
+                                name=runners['name'][i],
+                                team_id=int(team_id),
+                                gender=gender,
+                                rating=float(runners['rating'][i]),
+                                status=True)
+                runner.init_on_load()
+                team.runners.append(runner)
+            sim_teams.append(team)
+
+        return cls(sim_teams, gender)
+
     @property
     def is_simulated(self):
         return self._is_simulated
@@ -0,0 +1,315 @@
+"""Columnar database snapshots for use with NIRCAdb Package.
+
+This contains the code that exports the teams, runners, results and rating
+history tables to NumPy .npy files, one file per column, stored in a
+directory next to the database (XC_2016.db -> XC_2016.snapshot).  The
+columns are loaded with memory mapping, so opening a snapshot is nearly
+instant and processes reading the same snapshot share pages.
+
+Each update writes changed tables into a new version subdirectory and then
+replaces the manifest, so readers always see a complete snapshot.  The
+files of the previous manifest are kept until the following update, for
+readers still loading them.  Results and rating history rows are appended
+when older rows are unchanged.
+
+"""
+
+################################################################################
+##
+## Modules and Packages
+##
+################################################################################
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+import migrations
+
+FORMAT = 1
+
+################################################################################
+##
+## Table Definitions
+##
+################################################################################
+
+## Columns exported for each table as (name, SQL expression, kind)
+TABLES = {
+    'teams': [('id', 'id', 'int'),
+              ('name', 'name', 'str'),
+              ('region', 'region', 'str')],
+    'runners': [('id', 'id', 'int'),
+                ('name', 'name', 'str'),
+                ('team_id', 'team_id', 'int'),
+                ('gender', 'gender', 'str'),
+                ('rating', 'rating', 'float'),
+                ('status', 'status', 'bool')],
+    'results': [('id', 'id', 'int'),
+                ('runner_id', 'runner_id', 'int'),
+                ('race_id', 'race_id', 'int'),
+                ('date', 'date', 'date'),
+                ('distance', 'distance', 'int'),
+                ('rating', 'rating', 'float'),
+                ('time', 'time', 'str')],
+    'rating_history': [('id', 'id', 'int'),
+                       ('runner_id', 'runner_id', 'int'),
+                       ('result_id', 'result_id', 'int'),
+                       ('date', 'date', 'date'),
+                       ('rating_after', 'rating_after', 'float')]}
+
+## Tables whose new rows can be appended to an existing export
+APPENDABLE = ['results', 'rating_history']
+
+################################################################################
+##
+## Helper Functions
+##
+################################################################################
+
+def snapshot_path(database):
+    """Return the snapshot directory for a database filepath."""
+
+    return os.path.splitext(database)[0] + '.snapshot'
+
+def to_array(values, kind):
+    """Convert a list of column values to a NumPy array.
+
+    Missing integers are -1, missing floats are NaN, missing dates are NaT
+    and missing strings are empty.
+
+    Args:
+        values (list): Column values.
+        kind (str): Column kind, one of 'int', 'float', 'bool', 'date' and
+            'str'.
+
+    Returns:
+        NumPy array of the values.
+    """
+
+    if kind == 'int':
+        return np.array([-1 if x is None else x for x in values],
+                        dtype=np.int64)
+    elif kind == 'float':
+        return np.array([np.nan if x is None else x for x in values],
+                        dtype=np.float64)
+    elif kind == 'bool':
+        return np.array([bool(x) for x in values], dtype=np.bool_)
+    elif kind == 'date':
+        return np.array(['NaT' if x is None else str(x) for x in values],
+                        dtype='datetime64[D]')
+    else:
+        return np.array([u'' if x is None else unicode(x) for x in values],
+                        dtype=np.unicode_)
+
+################################################################################
+##
+## Snapshot Object
+##
+################################################################################
+
+class Snapshot:
+    """Represents a memory-mapped columnar snapshot of a database.
+
+    Attributes:
+        directory (str): Snapshot directory.
+        version (int): Snapshot version, incremented by every update.
+        schema (int): Schema version of the exported database.
+        teams (dict): Column arrays of the teams table.
+        runners (dict): Column arrays of the runners table.
+        results (dict): Column arrays of the results table.
+        rating_history (dict): Column arrays of the rating history table.
+    """
+
+    def __init__(self, directory):
+
+        self.directory = directory
+
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+
+        if manifest['format'] != FORMAT:
+            raise ValueError('Unsupported snapshot format {0}.'.\
+                             format(manifest['format']))
+
+        self.version = manifest['version']
+        self.schema = manifest['schema']
+
+        for table, info in manifest['tables'].iteritems():
+            path = os.path.join(directory, 'v{0}'.format(info['version']))
+            columns = dict()
+            for name, expression, kind in TABLES[table]:
+                columns[name] = np.load(os.path.join(path, '{0}.{1}.npy'.\
+                                                     format(table, name)),
+                                        mmap_mode='r')
+            setattr(self, table, columns)
+
+    @classmethod
+    def update(cls, session, directory):
+        """Create or update the snapshot of a database.
+
+        Tables are only exported if their fingerprint changed.  For results
+        and rating history, rows added after the previous export are
+        appended if the older rows are unchanged.
+
+        New files are written and the manifest replaced before any old 
+        files are deleted.  The version directories of the previous 
+        manifest are kept until the next update, since readers that opened
+        it may still be mapping its files; older directories are deleted.
+
+        Args:
+            session (Session): Database session object.
+            directory (str): Snapshot directory.
+
+        Returns:
+            Snapshot object for the updated snapshot.
+        """
+
+        manifest_file = os.path.join(directory, 'manifest.json')
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                manifest = json.load(f)
+            previous = cls._versions(manifest)
+            if manifest['format'] != FORMAT:
+                manifest = None
+        else:
+            manifest = None
+            previous = set()
+
+        if manifest is None:
+            manifest = {'format': FORMAT, 'version': 0, 'tables': dict()}
+
+        ## A new schema version may change the exported columns
+        raw = session.connection().connection
+        schema = migrations.schema_version(raw.cursor())
+        if manifest.get('schema') != schema:
+            manifest['tables'] = dict()
+
+        version = manifest['version'] + 1
+        path = os.path.join(directory, 'v{0}'.format(version))
+
+        changed = False
+        for table in sorted(TABLES):
+            info = manifest['tables'].get(table)
+            fingerprint = cls._fingerprint(session, table)
+
+            if info is not None and info['fingerprint'] == fingerprint:
+                continue
+
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+            ## Append new rows if the previously exported rows are unchanged
+            if info is not None and table in APPENDABLE and \
+               info['fingerprint'][1] is not None and \
+               cls._fingerprint(session, table, info['fingerprint'][1]) == \
+               info['fingerprint']:
+                old = os.path.join(directory, 'v{0}'.format(info['version']))
+                cls._export(session, table, path, info['fingerprint'][1],
+                            old)
+            else:
+                cls._export(session, table, path)
+
+            manifest['tables'][table] = {'version': version,
+                                         'fingerprint': fingerprint}
+            changed = True
+
+        if changed or manifest.get('schema') != schema:
+            manifest['version'] = version
+            manifest['schema'] = schema
+
+            ## Replace the manifest atomically where the platform allows
+            temp_file = manifest_file + '.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(manifest, f)
+            if os.name == 'nt' and os.path.exists(manifest_file):
+                os.remove(manifest_file)
+            os.rename(temp_file, manifest_file)
+
+            ## Only once the new manifest is in place, so no reader of it
+            ## needs the deleted files
+            cls._remove_unused(directory, cls._versions(manifest) | previous)
+
+        return cls(directory)
+
+    @staticmethod
+    def _fingerprint(session, table, max_id=None):
+        """Compute the fingerprint of a table, optionally up to an id.
+
+        The fingerprint is the row count, the largest id and a SHA-1 hash
+        of the exported columns of every row in id order, so any change to
+        an exported value changes it.
+        """
+
+        statement = 'SELECT {0} FROM {1}'.format(
+            ', '.join(expression for name, expression, kind in TABLES[table]),
+            table)
+        if max_id is not None:
+            statement += ' WHERE id <= {0:d}'.format(max_id)
+        statement += ' ORDER BY id'
+
+        digest = hashlib.sha1()
+        count = 0
+        last_id = None
+        for row in session.execute(statement):
+            digest.update(repr(tuple(row)))
+            count += 1
+            last_id = row[0]
+
+        return [count, last_id, digest.hexdigest()]
+
+    @staticmethod
+    def _export(session, table, path, after_id=None, old_path=None):
+        """Write the columns of a table, appending to an old export."""
+
+        columns = TABLES[table]
+        statement = 'SELECT {0} FROM {1}'.format(
+            ', '.join(expression for name, expression, kind in columns),
+            table)
+        if after_id is not None:
+            statement += ' WHERE id > {0:d}'.format(after_id)
+        statement += ' ORDER BY id'
+
+        rows = session.execute(statement).fetchall()
+        values = zip(*rows) if len(rows) > 0 else [[]]*len(columns)
+
+        for (name, expression, kind), column in zip(columns, values):
+            filename = '{0}.{1}.npy'.format(table, name)
+            array = to_array(column, kind)
+
+            if old_path is not None:
+                old = np.load(os.path.join(old_path, filename))
+                array = np.concatenate([old, array])
+
+            np.save(os.path.join(path, filename), array)
+
+    @staticmethod
+    def _versions(manifest):
+        """Return the names of the version directories used by a manifest."""
+
+        return set('v{0}'.format(info['version']) for info in \
+                   manifest.get('tables', dict()).itervalues())
+
+    @staticmethod
+    def _remove_unused(directory, used):
+        """Delete the version directories not in use.
+
+        Args:
+            directory (str): Snapshot directory.
+            used (set): Names of the version directories to keep.
+        """
+
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith('v') and os.path.isdir(path) and \
+               name not in used:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def team_index(self):
+        """Return a dictionary mapping team id to row in the team columns."""
+
+        return dict((team_id, i) for i, team_id in \
+                    enumerate(self.teams['id'].tolist()))
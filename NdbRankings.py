@@ -7,11 +7,9 @@ def main(gender):
     if gender not in ['M', 'W']:
         return
 
-    with ndb.db_session('sqlite:///test.db') as session:
+    with ndb.db_session('sqlite:///test.db', readonly=True) as session:
 
-        all_teams = ndb.Team.from_db(session)
-
-        sim = ndbsim.Sim(all_teams, gender)
+        sim = ndbsim.Sim.from_db(session, gender)
 
         sim.predict()
 
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import NIRCAdb as ndb
+from sqlalchemy import exc
+import argparse
+
+################################################################################
+##
+## Build Rating History for an Existing Database
+##
+################################################################################
+
+def main(database, in_memory=False):
+
+    with ndb.db_session('sqlite:///{0}'.format(database),
+                        in_memory=in_memory) as f:
+
+        try:
+            ## Replaying a runner creates any missing history rows
+            runners = f.query(ndb.Runner).\
+                      filter(ndb.Runner.results.any()).all()
+
+            num_changed = 0
+            for runner in runners:
+                old, new = runner.replay_results(f)
+                if old != new:
+                    num_changed += 1
+                    print "{0}: {1} -> {2}".format(runner.name, old, new)
+
+            print "Runners Replayed: {0}".format(len(runners))
+            print "Ratings Changed: {0}".format(num_changed)
+
+        except exc.SQLAlchemyError as e:
+            print e
+            return False
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--database', help='database to modify.',
+                        default = 'XC_2016.db')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='replay on an in-memory copy of the database.')
+
+    args = parser.parse_args()
+    database = args.database
+
+    main(database, args.in_memory)
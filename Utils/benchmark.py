@@ -0,0 +1,553 @@
+#!/usr/bin/env python
+
+"""Benchmarks for the NIRCAdb Package.
+
+Each benchmark runs against a temporary copy of the given database, so the
+original file is never modified.  Run a single benchmark using:
+
+    python benchmark.py 'benchmark' -d 'database'
+
+"""
+
+import NIRCAdb as ndb
+from NIRCAdb import errors as ndberrors
+from NIRCAdb import fastread as ndbfastread
+from NIRCAdb import names as ndbnames
+from NIRCAdb import search as ndbsearch
+from NIRCAdb import sim as ndbsim
+import sqlalchemy as sql
+import sqlalchemy.event
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+import shutil
+import tempfile
+import timeit
+
+from fuzzywuzzy import process
+from multiprocessing.pool import ThreadPool
+from sqlalchemy.orm import sessionmaker
+
+################################################################################
+##
+## Helper Functions
+##
+################################################################################
+
+def copy_database(database):
+    """Copy a database to a temporary directory and return its URL."""
+
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, os.path.basename(database))
+    shutil.copy2(database, filename)
+
+    return 'sqlite:///{0}'.format(filename)
+
+def report(name, seconds, number):
+    """Print the time per call of a benchmark."""
+
+    print "{0:<40} {1:>10.3f} ms".format(name, 1000.*seconds/number)
+
+################################################################################
+##
+## Benchmarks
+##
+################################################################################
+
+def bench_sessions(database, number=50):
+    """Compare per-session overhead with and without cached engines."""
+
+    database_ref = copy_database(database)
+
+    ## Previous behaviour: new engine and schema check for every session
+    def uncached():
+        engine = sql.create_engine(database_ref, echo=False)
+        ndb.database.Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        ndb.Team.from_db(session)
+        session.commit()
+        session.close()
+
+    def cached():
+        with ndb.db_session(database_ref) as session:
+            ndb.Team.from_db(session)
+
+    cached()
+    report('session (engine per call)', timeit.timeit(uncached,
+                                                      number=number), number)
+    report('session (cached engine)', timeit.timeit(cached, number=number),
+           number)
+
+def bench_threads(database, number=200, processes=4):
+    """Query two databases concurrently from a pool of threads."""
+
+    database_refs = [copy_database(database), copy_database(database)]
+
+    def work(database_ref):
+        with ndb.db_session(database_ref) as session:
+            ndb.Runner.from_db(session, gender='M', status=True)
+            return str(session.bind.url) == database_ref
+
+    jobs = [database_refs[i % 2] for i in range(number)]
+    for database_ref in database_refs:
+        work(database_ref)
+
+    pool = ThreadPool(processes)
+    start = timeit.default_timer()
+    correct = pool.map(work, jobs)
+    report('query ({0} threads, 2 databases)'.format(processes),
+           timeit.default_timer() - start, number)
+    pool.close()
+
+    print "Sessions bound to the wrong database: {0}".\
+          format(correct.count(False))
+
+def bench_queries(database, gender='M'):
+    """Count queries issued to build a national Sim and read its teams."""
+
+    database_ref = copy_database(database)
+    engine = ndb.get_engine(database_ref)
+
+    counter = []
+    def count(*args):
+        counter.append(1)
+    sql.event.listen(engine, 'before_cursor_execute', count)
+
+    def lazy(session):
+        sim = ndbsim.Sim(ndb.Team.from_db(session), gender)
+        return [runner.team.name for runner in sim.runners]
+
+    def eager(session):
+        sim = ndbsim.Sim.from_db(session, gender)
+        return [runner.team.name for runner in sim.runners]
+
+    for name, build in [('sim (lazy loading)', lazy),
+                        ('sim (eager loading)', eager)]:
+        del counter[:]
+        with ndb.db_session(database_ref) as session:
+            start = timeit.default_timer()
+            build(session)
+            report(name, timeit.default_timer() - start, 1)
+        print "{0:<40} {1:>10d} queries".format(name, len(counter))
+
+    sql.event.remove(engine, 'before_cursor_execute', count)
+
+def bench_cache(database, number=50):
+    """Compare repeated team list loads with and without the query cache."""
+
+    database_ref = copy_database(database)
+
+    def load(cached):
+        with ndb.db_session(database_ref, readonly=True) as session:
+            ndb.Team.from_db(session, cached=cached)
+
+    load(False)
+    ndb.query_cache.clear()
+    report('team list (uncached)', timeit.timeit(lambda: load(False),
+                                                 number=number), number)
+    report('team list (query cache)', timeit.timeit(lambda: load(True),
+                                                    number=number), number)
+    print "Query cache: {0}".format(ndb.query_cache.info())
+
+def bench_reads(database, number=10, gender='M'):
+    """Compare ORM reads with the Core queries of the fastread module."""
+
+    database_ref = copy_database(database)
+
+    def orm_runners(session):
+        return [(runner.id, runner.name, runner.team.name, runner.rating) \
+                for runner in ndb.Runner.from_db(session, gender=gender,
+                                                 status=True, load_team=True)]
+
+    def orm_sizes(session):
+        return [(team.name, team.size()) for team in \
+                ndb.Team.from_db(session, load_runners=True)]
+
+    def orm_top(session):
+        return ndbsim.Sim.from_db(session, gender).runners
+
+    reads = [('runners', orm_runners,
+              lambda session: ndbfastread.runners(session, gender=gender,
+                                                  status=True)),
+             ('runners (array)', None,
+              lambda session: ndbfastread.runners(session, gender=gender,
+                                                  status=True,
+                                                  output='array')),
+             ('team sizes', orm_sizes, ndbfastread.team_sizes),
+             ('top 7 per team', orm_top,
+              lambda session: ndbfastread.top_runners(session, 7,
+                                                      gender=gender))]
+
+    with ndb.db_session(database_ref, readonly=True) as session:
+        for name, orm, core in reads:
+            if orm is not None:
+                report('{0} (ORM)'.format(name),
+                       timeit.timeit(lambda: orm(session), number=number),
+                       number)
+                session.expunge_all()
+            report('{0} (Core)'.format(name),
+                   timeit.timeit(lambda: core(session), number=number),
+                   number)
+
+def bench_filters(database, number=5, sizes=[10, 1000, 10000]):
+    """Compare one IN filter and from_db() for long runner name lists.
+
+    from_db() only splits lists longer than IN_CHUNK_SIZE, which depends on
+    the host parameter limit of the SQLite version.
+    """
+
+    database_ref = copy_database(database)
+
+    with ndb.db_session(database_ref, readonly=True) as session:
+        existing = [row[0] for row in session.query(ndb.Runner.name)]
+        print "IN chunk size: {0}".format(ndb.database.IN_CHUNK_SIZE)
+
+        for size in sizes:
+
+            ## Half existing names, the rest missing like unmatched results
+            names = existing[:size//2]
+            names += ['Missing Runner {0}'.format(i) \
+                      for i in range(size - len(names))]
+
+            def single():
+                query, params = ndb.Runner._query(names, [], None, None,
+                                                  False, False)
+                return query(session).params(**params).all()
+
+            def chunked():
+                return ndb.Runner.from_db(session, names=names)
+
+            try:
+                report('{0} names (single IN)'.format(size),
+                       timeit.timeit(single, number=number), number)
+                expected = set(runner.id for runner in single())
+            except sql.exc.OperationalError as e:
+                print "{0} names (single IN) failed: {1}".format(size, e)
+                expected = None
+
+            report('{0} names (from_db)'.format(size),
+                   timeit.timeit(chunked, number=number), number)
+            if expected is not None:
+                print "Identical results: {0}".format(
+                    expected == set(runner.id for runner in chunked()))
+
+def bench_statements(database, number=200):
+    """Time single-runner from_db calls, as made once per result row.
+
+    The baseline runs the same queries spoiled, so every call builds and
+    compiles the query again, as from_db() did before baked queries.
+    """
+
+    database_ref = copy_database(database)
+
+    with ndb.db_session(database_ref, readonly=True) as session:
+        runners = [(runner.name, runner.team.name, runner.gender) for runner \
+                   in ndb.Runner.from_db(session, status=True,
+                                         load_team=True)[:number]]
+
+        calls = [('runner by name and team',
+                  lambda name, team, gender: ndb.Runner._query(
+                      [name], [team], None, None, False, False)),
+                 ('runner by name, team and gender',
+                  lambda name, team, gender: ndb.Runner._query(
+                      [name], [team], gender, None, True, False)),
+                 ('team by name',
+                  lambda name, team, gender: ndb.Team._query(
+                      [team], [], False, None, None, None)),
+                 ('team top 7 runners',
+                  lambda name, team, gender: ndb.Team._query(
+                      [team], [], True, gender, True, 7))]
+
+        for label, call in calls:
+            def unbaked():
+                for name, team, gender in runners:
+                    query, params = call(name, team, gender)
+                    query.spoil(full=True)(session).params(**params).all()
+            def baked():
+                for name, team, gender in runners:
+                    query, params = call(name, team, gender)
+                    query(session).params(**params).all()
+            baked()
+            report('{0} (unbaked)'.format(label),
+                   timeit.timeit(unbaked, number=1), len(runners))
+            report('{0} (baked)'.format(label),
+                   timeit.timeit(baked, number=1), len(runners))
+
+def bench_keys(database, number=30):
+    """Compare fuzzy search and the name key fast path for runner names.
+
+    Names are varied the ways results files list them: 'Last, First' 
+    order, upper case and a nickname.
+    """
+
+    database_ref = copy_database(database)
+
+    with ndb.db_session(database_ref, readonly=True) as session:
+        names = [runner.name for runner in ndb.Runner.from_db(session)]
+        nicknames = dict((group[0], group[1]) for group in \
+                         ndbnames.NICKNAMES)
+
+        queries = []
+        for name in names[::len(names)//number][:number]:
+            words = name.split()
+            queries += ['{0}, {1}'.format(words[-1], ' '.join(words[:-1])),
+                        name.upper(),
+                        ' '.join([nicknames.get(words[0].lower(), words[0])] +
+                                 words[1:])]
+
+        index = ndbsearch._database_index(session, ndb.Runner)
+
+        def fuzzy():
+            return [ndbsearch._search(query, 1, index)[0][0] \
+                    for query in queries]
+
+        def keys():
+            return [ndbsearch.runner_search(query, limit=1,
+                                            session=session)[0][0].id \
+                    for query in queries]
+
+        keys()
+        report('fuzzy search', timeit.timeit(fuzzy, number=1), len(queries))
+        report('name key, then fuzzy search',
+               timeit.timeit(keys, number=1), len(queries))
+
+        hits = sum(1 for query in queries if session.query(ndb.Runner).\
+                   filter(ndb.Runner.name_key == \
+                          ndbnames.name_key(query)).count() > 0)
+        print "Name key hits: {0} of {1}".format(hits, len(queries))
+
+def bench_matching(database, finishers=500, gender='M'):
+    """Compare per-finisher and batch matching of a results file."""
+
+    database_ref = copy_database(database)
+
+    with ndb.db_session(database_ref, readonly=True) as session:
+        runners = ndb.Runner.from_db(session, gender=gender, load_team=True)
+
+        ## Every third finisher has a typo in the name, like hand-typed
+        ## results, and every tenth is a new runner
+        pairs = []
+        expected = []
+        for i, runner in enumerate(runners[::len(runners)//finishers]):
+            name = runner.name
+            if i % 10 == 5:
+                pairs.append(('Newcomer {0} Runner'.format(i),
+                              runner.team.name))
+                expected.append(None)
+                continue
+            if i % 3 == 0:
+                name = name[:len(name)//2] + 'x' + name[len(name)//2 + 1:]
+            pairs.append((name, runner.team.name))
+            expected.append(runner)
+        pairs = pairs[:finishers]
+        expected = expected[:finishers]
+
+        def single():
+            search_results = []
+            for name, team in pairs:
+                runner_list = [runner for runner in runners if \
+                               runner.team.name == team]
+                search_results.append(ndbsearch.runner_search(
+                    name, limit=1, runner_list=runner_list)[0])
+            return search_results
+
+        def batch():
+            return ndbsearch.batch_runner_search(pairs, runner_list=runners)
+
+        results = []
+        for label, match in [('per finisher', single), ('batch', batch)]:
+            start = timeit.default_timer()
+            search_results = match()
+            report('{0} finishers ({1})'.format(len(pairs), label),
+                   timeit.default_timer() - start, 1)
+
+            matched = [runner for runner, ratio in search_results \
+                       if runner is not None]
+            print "Correct: {0}, runners matched twice: {1}".format(
+                sum(runner is match for (runner, ratio), match in \
+                    zip(search_results, expected)),
+                len(matched) - len(set(matched)))
+            results.append(search_results)
+
+        confirmed = [(name, runner.id) for (name, team), (runner, ratio) in \
+                     zip(pairs, results[1]) \
+                     if runner is not None and name != runner.name]
+
+    ## The next week, the confirmed spellings are looked up as aliases
+    with ndb.db_session(database_ref) as session:
+        ndb.RunnerAlias.add(session, confirmed)
+
+    with ndb.db_session(database_ref, readonly=True) as session:
+        runners = ndb.Runner.from_db(session, gender=gender, load_team=True)
+
+        start = timeit.default_timer()
+        runner_aliases = ndb.RunnerAlias.lookup(session, pairs, gender=gender)
+        claimed = set(runner.id for runner in runner_aliases.values())
+        new_pairs = [pair for pair in pairs if pair not in runner_aliases]
+        ndbsearch.batch_runner_search(new_pairs, runner_list=[
+            runner for runner in runners if runner.id not in claimed])
+        report('{0} finishers (aliases, then batch)'.format(len(pairs)),
+               timeit.default_timer() - start, 1)
+
+def bench_parallel(database, pattern='NIRCA XC Nationals*_Raw.csv'):
+    """Time batch matching of the Nationals fields with 1 to N processes.
+
+    The finishers of the raw Nationals files are looked up by runner id,
+    and every name gets a typo, so every finisher is fuzzy matched.
+    """
+
+    database_ref = copy_database(database)
+    raw = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       '2016_Results', 'Raw')
+
+    runner_ids = []
+    for filename in sorted(glob.glob(os.path.join(raw, pattern))):
+        with open(filename, 'rb') as f:
+            runner_ids += [int(line[0]) for line in csv.reader(f) if line]
+
+    with ndb.db_session(database_ref, readonly=True) as session:
+        runners = ndb.Runner.from_db(session, load_team=True)
+        by_id = dict((runner.id, runner) for runner in runners)
+
+        pairs = []
+        for runner_id in runner_ids:
+            name = by_id[runner_id].name
+            name = name[:len(name)//2] + 'x' + name[len(name)//2 + 1:]
+            pairs.append((name, by_id[runner_id].team.name))
+
+        counts = [1]
+        while counts[-1]*2 <= multiprocessing.cpu_count():
+            counts.append(counts[-1]*2)
+        if counts[-1] < multiprocessing.cpu_count():
+            counts.append(multiprocessing.cpu_count())
+
+        results = []
+        for processes in counts:
+            start = timeit.default_timer()
+            search_results = ndbsearch.batch_runner_search(
+                pairs, runner_list=runners, processes=processes)
+            report('{0} finishers ({1} processes)'.format(len(pairs),
+                                                          processes),
+                   timeit.default_timer() - start, 1)
+            results.append([(None if runner is None else runner.id, ratio) \
+                            for runner, ratio in search_results])
+
+        print "Identical matches: {0}".format(
+            all(result == results[0] for result in results))
+
+def bench_search(database, number=20):
+    """Compare fuzzy runner search over every name and over index candidates.
+    """
+
+    database_ref = copy_database(database)
+
+    with ndb.db_session(database_ref, readonly=True) as session:
+        runners = ndb.Runner.from_db(session)
+        names = [runner.name for runner in runners]
+
+        ## Result names with one character changed, as typed by hand
+        queries = [name[:len(name)//2] + 'x' + name[len(name)//2 + 1:] for \
+                   name in names[::len(names)//number][:number]]
+
+        def full():
+            return [process.extractOne(query, names)[1] for query in queries]
+
+        def indexed():
+            return [ndbsearch.runner_search(query, limit=1,
+                                            session=session)[0][1] \
+                    for query in queries]
+
+        ## The index is built once and cached, like the compiled statements
+        indexed()
+        report('full scan', timeit.timeit(full, number=1), len(queries))
+        report('trigram candidates', timeit.timeit(indexed, number=1),
+               len(queries))
+        print "Identical ratios: {0}".format(full() == indexed())
+
+def bench_upsert(database, sizes=[100, 1000]):
+    """Compare per-runner creation with bulk upserts of roster records."""
+
+    database_ref = copy_database(database)
+    Session = sessionmaker(bind=ndb.get_engine(database_ref))
+
+    session = Session()
+    existing = [(runner.name, runner.team.name, runner.gender) for runner \
+                in ndb.Runner.from_db(session, load_team=True)]
+    session.close()
+
+    for size in sizes:
+
+        ## Half runners on the roster already, the rest new
+        records = existing[:size//2]
+        records += [('New Runner {0}'.format(i), records[i % len(records)][1],
+                     records[i % len(records)][2]) \
+                    for i in range(size - len(records))]
+
+        def single(session):
+            ids = []
+            for name, team, gender in records:
+                try:
+                    runner = ndb.Runner.from_db(session, names=name,
+                                                team_list=team)[0]
+                except ndberrors.QueryError:
+                    runner = ndb.Runner(name=name, status=True, gender=gender)
+                    team = ndb.Team.from_db(session, names=team)[0]
+                    team.runners.append(runner)
+                    session.flush()
+                ids.append(runner.id)
+            return ids
+
+        def bulk(session):
+            return ndb.Runner.bulk_upsert(session, records)
+
+        ## Each run is rolled back, so both start from the same database
+        results = []
+        for label, load in [('per runner', single), ('bulk upsert', bulk)]:
+            session = Session()
+            start = timeit.default_timer()
+            results.append(load(session))
+            report('{0} records ({1})'.format(size, label),
+                   timeit.default_timer() - start, 1)
+            session.rollback()
+            session.close()
+
+        print "Identical ids: {0}".format(results[0] == results[1])
+
+BENCHMARKS = {'cache': bench_cache,
+              'filters': bench_filters,
+              'keys': bench_keys,
+              'matching': bench_matching,
+              'parallel': bench_parallel,
+              'queries': bench_queries,
+              'reads': bench_reads,
+              'search': bench_search,
+              'sessions': bench_sessions,
+              'statements': bench_statements,
+              'threads': bench_threads,
+              'upsert': bench_upsert}
+
+################################################################################
+##
+## Main Function
+##
+################################################################################
+
+def main(benchmarks, database):
+
+    for name in benchmarks:
+        print "Benchmark: {0}".format(name)
+        BENCHMARKS[name](database)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run.',
+                        default=sorted(BENCHMARKS.keys()))
+    parser.add_argument('-d', '--database', help='database to copy.',
+                        default='XC_2016.db')
+
+    args = parser.parse_args()
+
+    main(args.benchmarks, args.database)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+import NIRCAdb as ndb
+from NIRCAdb import snapshot as ndbsnapshot
+from sqlalchemy import exc
+import argparse
+
+################################################################################
+##
+## Create or Update the Columnar Snapshot of a Database
+##
+################################################################################
+
+def main(database):
+
+    with ndb.db_session('sqlite:///{0}'.format(database),
+                        readonly=True) as f:
+
+        try:
+            directory = ndbsnapshot.snapshot_path(database)
+            snapshot = ndbsnapshot.Snapshot.update(f, directory)
+            print "Snapshot: {0} (version {1})".format(directory,
+                                                       snapshot.version)
+            print "Runners: {0}".format(len(snapshot.runners['id']))
+            print "Results: {0}".format(len(snapshot.results['id']))
+
+        except exc.SQLAlchemyError as e:
+            print e
+            return False
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--database', help='database to export.',
+                        default = 'XC_2016.db')
+
+    args = parser.parse_args()
+    database = args.database
+
+    main(database)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import NIRCAdb as ndb
+from NIRCAdb import errors as ndberrors
+from sqlalchemy import exc
+import argparse
+
+################################################################################
+##
+## Correct or Delete a Single Result
+##
+################################################################################
+
+def main(database, result_id, time=None, rating=None, runner_id=None,
+         delete=False):
+
+    with ndb.db_session('sqlite:///{0}'.format(database)) as f:
+
+        try:
+            result = f.query(ndb.Result).\
+                     filter(ndb.Result.id == result_id).first()
+            if result is None:
+                print "No result found with id {0}.".format(result_id)
+                return False
+
+            if delete:
+                deltas = result.remove(f)
+            else:
+                deltas = result.correct(f, time=time, rating=rating,
+                                        runner_id=runner_id)
+
+            ## Report rating changes for affected runners
+            if len(deltas) == 0:
+                print "No Speed Ratings changed."
+            for runner, (old, new) in deltas.iteritems():
+                print "{0}: {1} -> {2}".format(runner.name, old, new)
+
+        except (exc.SQLAlchemyError, ndberrors.QueryError) as e:
+            print e
+            return False
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('result', type=int, help='id of result to correct.')
+    parser.add_argument('-d', '--database', help='database to modify.',
+                        default = 'XC_2016.db')
+    parser.add_argument('-t', '--time', help='corrected time (MM:SS.ms).')
+    parser.add_argument('-r', '--rating', type=float,
+                        help='corrected result Speed Rating.')
+    parser.add_argument('--runner', type=int,
+                        help='id of the runner the result belongs to.')
+    parser.add_argument('--delete', action='store_true',
+                        help='delete the result.')
+
+    args = parser.parse_args()
+
+    main(args.database, args.result, args.time, args.rating, args.runner,
+         args.delete)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import NIRCAdb as ndb
+from NIRCAdb import export as ndbexport
+from sqlalchemy import exc
+import argparse
+import os
+
+################################################################################
+##
+## Export Runners, Teams and Results to CSV or JSON
+##
+################################################################################
+
+## Generator keyword arguments and exported fields for each table
+TABLES = {'runners': (ndb.Runner.iter_from_db, {'load_team': True},
+                      ['id', 'name', 'team.name', 'gender', 'rating',
+                       'status']),
+          'teams': (ndb.Team.iter_from_db, {},
+                    ['id', 'name', 'region']),
+          'results': (ndb.Result.iter_from_db, {'load_runner': True},
+                      ['id', 'runner_id', 'runner.name', 'name', 'date',
+                       'distance', 'time', 'rating'])}
+
+WRITERS = {'csv': ndbexport.write_csv,
+           'json': ndbexport.write_json}
+
+def main(database, directory, tables, fmt='csv'):
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with ndb.db_session('sqlite:///{0}'.format(database),
+                        readonly=True) as f:
+
+        try:
+            for table in tables:
+                iter_from_db, kwargs, fields = TABLES[table]
+                filename = os.path.join(directory,
+                                        '{0}.{1}'.format(table, fmt))
+                count = WRITERS[fmt](filename, iter_from_db(f, **kwargs),
+                                     fields)
+                print "{0}: {1} rows".format(filename, count)
+
+        except exc.SQLAlchemyError as e:
+            print e
+            return False
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('tables', nargs='*', help='tables to export.',
+                        default=sorted(TABLES.keys()))
+    parser.add_argument('-d', '--database', help='database to export.',
+                        default = 'XC_2016.db')
+    parser.add_argument('-o', '--output', help='output directory.',
+                        default = 'Export')
+    parser.add_argument('--format', choices=sorted(WRITERS.keys()),
+                        default='csv', help='output format.')
+
+    args = parser.parse_args()
+
+    main(args.database, args.output, args.tables, args.format)
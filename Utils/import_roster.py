@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import NIRCAdb as ndb
+from sqlalchemy import exc
+import argparse
+import csv
+
+def read_roster(rosterfile):
+    """Read roster records (name, team, gender, region) from a CSV file.
+
+    Each line holds a runner name, team name, gender and, optionally, the
+    team region.
+    """
+
+    records = []
+    with open(rosterfile, 'rb') as f:
+        for line in csv.reader(f):
+            if len(line) < 3:
+                continue
+            name, team, gender = [value.strip() for value in line[:3]]
+            region = line[3].strip() if len(line) > 3 else ''
+            records.append((name, team, gender, region or None))
+
+    return records
+
+def main(database, rosterfile, status=True):
+
+    records = read_roster(rosterfile)
+
+    with ndb.db_session('sqlite:///{0}'.format(database)) as f:
+
+        try:
+            ## Teams first, so new clubs on the roster exist for the runners
+            teams = dict()
+            for name, team, gender, region in records:
+                if teams.get(team) is None:
+                    teams[team] = region
+            ndb.Team.bulk_upsert(f, teams.items())
+
+            ids = ndb.Runner.bulk_upsert(f, [(name, team, gender) for \
+                                             name, team, gender, region in \
+                                             records], status=status)
+        except exc.SQLAlchemyError as e:
+            print e
+            return False
+
+    print "{0} runners on {1} teams imported".format(len(set(ids)),
+                                                    len(teams))
+    return True
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file', help='roster file to import.')
+    parser.add_argument('-d', '--database', help='database to modify.',
+                        default = 'XC_2016.db')
+    parser.add_argument('--inactive', action='store_true',
+                        help='add new runners as inactive.')
+
+    args = parser.parse_args()
+
+    main(args.database, args.file, status=not args.inactive)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import NIRCAdb as ndb
+from NIRCAdb import errors as ndberrors
+from NIRCAdb import ingest as ndbingest
+from sqlalchemy import exc
+import argparse
+import csv
+import datetime
+
+################################################################################
+##
+## Ingest Formatted Results Files Without the Update Wizard
+##
+################################################################################
+
+def read_manifest(manifestfile):
+    """Read race records (file, name, date, gender, distance) from a CSV file.
+
+    Dates are written as YYYY-MM-DD.
+    """
+
+    races = []
+    with open(manifestfile, 'rb') as f:
+        for line in csv.reader(f):
+            if len(line) < 5:
+                continue
+            resultfile, name, date, gender, distance = [value.strip() for \
+                                                        value in line[:5]]
+            races.append((resultfile, name,
+                          datetime.datetime.strptime(date, '%Y-%m-%d').date(),
+                          gender, int(distance)))
+
+    return races
+
+def ingest_race(database, race, options):
+    """Match, calibrate and add one race, returning True if it was added."""
+
+    resultfile, name, date, gender, distance = race
+    ingest = ndbingest.Ingest(resultfile, name, date, distance, gender,
+                              team_threshold=options.team_threshold,
+                              runner_threshold=options.runner_threshold,
+                              new_threshold=options.new_threshold,
+                              create_new=options.create_new)
+
+    with ndb.db_session('sqlite:///{0}'.format(database),
+                        readonly=options.dry_run) as f:
+
+        try:
+            ndb.Race.from_db(f, names=name, dates=date, gender=gender)
+            print "{0} ({1}) is already in the database".format(name, gender)
+            return False
+        except ndberrors.QueryError:
+            pass
+
+        ingest.match(f, processes=options.processes)
+        ingest.calibrate(r200=options.r200)
+
+        accepted = len(ingest.rows_with_status('accepted'))
+        new = len(ingest.rows_with_status('new'))
+        held = len(ingest.rows_with_status('review'))
+        print "{0} ({1}): {2} accepted, {3} new, {4} held for review".format(
+            name, gender, accepted, new, held)
+        if ingest.calibrated:
+            print "200 SR Time: {0:.3f} s from {1} runners, "\
+                "Error: {2:.3f}".format(ingest.r200, ingest.calibration_size,
+                                        ingest.error)
+
+        filename = ingest.write_report(options.report)
+        if filename is not None:
+            print "Review Report Written: {0}".format(filename)
+
+        if not ingest.calibrated:
+            print "Too few rated runners to calibrate the 200 SR Time, "\
+                "give it with --r200"
+        if options.dry_run:
+            return False
+        if not ingest.calibrated or (options.strict and held > 0):
+            print "{0} ({1}) not added".format(name, gender)
+            return False
+
+        ingest.commit(f)
+
+    return True
+
+def main(database, races, options):
+
+    added = 0
+    for race in races:
+        try:
+            if ingest_race(database, race, options):
+                added += 1
+        except (exc.SQLAlchemyError, ValueError, IOError) as e:
+            print e
+
+    print "Races Added: {0} of {1}".format(added, len(races))
+    return added == len(races)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file', nargs='?', help='formatted result file to add.')
+    parser.add_argument('-d', '--database', help='database to modify.',
+                        default = 'XC_2016.db')
+    parser.add_argument('-n', '--name', help='race name.')
+    parser.add_argument('--date', help='race date (YYYY-MM-DD).')
+    parser.add_argument('-g', '--gender', choices=['M', 'W'],
+                        help='race gender.')
+    parser.add_argument('--distance', type=int, choices=[4000, 5000, 6000,
+                                                         8000],
+                        help='race distance in meters.')
+    parser.add_argument('-m', '--manifest',
+                        help='CSV file of races to add, one per line as '
+                        'file, name, date, gender, distance.')
+    parser.add_argument('--team-threshold', type=int,
+                        default=ndbingest.TEAM_THRESHOLD,
+                        help='lowest team match ratio accepted.')
+    parser.add_argument('--runner-threshold', type=int,
+                        default=ndbingest.RUNNER_THRESHOLD,
+                        help='lowest runner match ratio accepted.')
+    parser.add_argument('--new-threshold', type=int,
+                        default=ndbingest.NEW_THRESHOLD,
+                        help='lowest runner match ratio; names without a '
+                        'match are new runners.')
+    parser.add_argument('--create-new', action='store_true',
+                        help='add names without a match as new runners, '
+                        'instead of holding them for review.')
+    parser.add_argument('--r200', type=float,
+                        help='200 SR time in seconds, instead of calibrating.')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='number of worker processes for matching.')
+    parser.add_argument('-r', '--report', default='Review',
+                        help='review report directory.')
+    parser.add_argument('--strict', action='store_true',
+                        help='do not add races with rows held for review.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='match and calibrate without adding races.')
+
+    args = parser.parse_args()
+
+    if args.manifest is not None:
+        races = read_manifest(args.manifest)
+    elif None in [args.file, args.name, args.date, args.gender, args.distance]:
+        parser.error('a file with --name, --date, --gender and --distance, '
+                     'or --manifest is required.')
+    else:
+        races = [(args.file, args.name,
+                  datetime.datetime.strptime(args.date, '%Y-%m-%d').date(),
+                  args.gender, args.distance)]
+
+    main(args.database, races, args)
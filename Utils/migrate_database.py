@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import NIRCAdb as ndb
+from NIRCAdb import migrations
+from sqlalchemy import exc
+import argparse
+
+################################################################################
+##
+## Bring a Database up to the Current Schema Version
+##
+################################################################################
+
+def main(database):
+
+    try:
+        ## Creating the engine applies any missing migrations
+        engine = ndb.get_engine('sqlite:///{0}'.format(database))
+
+        raw = engine.raw_connection()
+        try:
+            version = migrations.schema_version(raw.cursor())
+        finally:
+            raw.close()
+
+        print "Schema Version: {0} of {1}".format(version,
+                                                  len(migrations.MIGRATIONS))
+
+    except exc.SQLAlchemyError as e:
+        print e
+        return False
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('database', help='database to migrate.')
+
+    args = parser.parse_args()
+    database = args.database
+
+    main(database)
@@ -1,37 +1,58 @@
 import argparse
 import NIRCAdb as ndb
+from NIRCAdb import errors as ndberrors
 from sqlalchemy import exc
 import shutil
 import os
 
 ################################################################################
 ##
-## Example 1: Print List of Teams from a Specific Region
+## Roll Over the Database for a New Season
 ##
 ################################################################################
 
 def main(database):
+    """Delete the season's races, results and rating history.
 
-    ## First back-up database    
+    The roll-over runs on an in-memory copy written back in one 
+    transaction.  The backup copy written first, <database>_backup.db,
+    protects against a failed write-back: a WriteBackError leaves the file
+    unmodified, and anything that damages the file while it is written can
+    be undone from the backup.  It also keeps the prior season's races and
+    results once the roll-over succeeds.
+    """
+
+    ## First back-up database, with the write-ahead log checkpointed so the
+    ## file holds every committed change
+    database_ref = 'sqlite:///{0}'.format(database)
+    ndb.get_engine(database_ref).execute('PRAGMA wal_checkpoint(TRUNCATE)')
     shutil.copy2(database,
                  "{0}_backup.db".format(os.path.splitext(database)[0]))
 
-    ## Open database
-    with ndb.db_session('sqlite:///{0}'.format(database)) as f:
-
-        try:
+    ## Work on an in-memory copy, so the database file is only replaced if
+    ## every step succeeds
+    try:
+        with ndb.db_session(database_ref, in_memory=True) as f:
 
-            ## Delete all results
+            ## Delete rating history, results and races
+            f.query(ndb.RatingHistory).delete()
             num_deleted = f.query(ndb.Result).delete()
+            f.query(ndb.Race).delete()
             print "Results Deleted: {0}".format(num_deleted)
 
             ## Set all runners to inactive
             f.query(ndb.Runner).update({ndb.Runner.status: 0})
             print "All Runner statuses reset."
 
-        except exc.SQLAlchemyError as e:
-            print e
-            return False
+    except exc.SQLAlchemyError as e:
+        print e
+        return False
+    except ndberrors.WriteBackError as e:
+        print e
+        print "Database not modified, run the roll-over again."
+        return False
+
+    return True
 
 if __name__ == '__main__':
 
@@ -42,10 +63,3 @@ if __name__ == '__main__':
     database = args.database
 
     main(database)
-                
-
-            
-
-        
-
-        
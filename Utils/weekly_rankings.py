@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import NIRCAdb as ndb
+from NIRCAdb import rankings as ndbrankings
+from NIRCAdb import snapshot as ndbsnapshot
+from sqlalchemy import exc
+import argparse
+import datetime
+
+################################################################################
+##
+## Generate Weekly Rankings for Every Week and Gender
+##
+################################################################################
+
+def main(database, directory, dates=None, formats=['csv', 'json', 'html'],
+         use_snapshot=False):
+
+    with ndb.db_session('sqlite:///{0}'.format(database),
+                        readonly=True) as f:
+
+        try:
+            ## Default to the weeks containing a race in the database
+            if dates is None:
+                race_dates = [row[0] for row in \
+                              f.query(ndb.Result.date).distinct()]
+                dates = ndbrankings.week_cutoffs(race_dates)
+
+            rankings = ndbrankings.Rankings(dates)
+            if use_snapshot:
+                rankings.generate(ndbsnapshot.Snapshot.update(
+                    f, ndbsnapshot.snapshot_path(database)))
+            else:
+                rankings.generate(f)
+            filenames = rankings.export(directory, formats)
+            print "Files Written: {0}".format(len(filenames))
+
+        except exc.SQLAlchemyError as e:
+            print e
+            return False
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--database', help='database to rank.',
+                        default = 'XC_2016.db')
+    parser.add_argument('-o', '--output', help='output directory.',
+                        default = 'Rankings')
+    parser.add_argument('--dates', nargs='+',
+                        help='weekly cutoff dates (YYYY-MM-DD).')
+    parser.add_argument('--formats', nargs='+', default=['csv', 'json', 'html'],
+                        help='output formats (csv, json, html).')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='read from the columnar database snapshot.')
+
+    args = parser.parse_args()
+
+    dates = None
+    if args.dates is not None:
+        dates = [datetime.datetime.strptime(date, '%Y-%m-%d').date() \
+                 for date in args.dates]
+
+    main(args.database, args.output, dates, args.formats, args.snapshot)
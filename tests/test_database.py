@@ -0,0 +1,119 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import NIRCAdb as ndb
+from NIRCAdb import errors as ndberrors
+from NIRCAdb import fastread as ndbfastread
+from sqlalchemy import exc
+
+################################################################################
+##
+## Database Objects
+##
+################################################################################
+
+class DatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.database_ref = 'sqlite:///{0}'.format(
+            os.path.join(self.directory, 'test.db'))
+        with ndb.db_session(self.database_ref) as f:
+            ndb.Team.bulk_upsert(f, [('Villanova', None)])
+
+    def tearDown(self):
+
+        ndb.get_engine(self.database_ref).dispose()
+        shutil.rmtree(self.directory)
+
+class UpsertTest(DatabaseTest):
+
+    def test_bulk_upsert_past_parameter_limit(self):
+
+        ## More values than a single statement can bind
+        count = ndb.database.HOST_PARAMETER_LIMIT // 2
+        records = [('Runner {0}'.format(i), 'Villanova', 'M') for i in \
+                   range(count)]
+        with ndb.db_session(self.database_ref) as f:
+            ids = ndb.Runner.bulk_upsert(f, records)
+            self.assertEqual(len(set(ids)), count)
+            self.assertEqual(ndb.Runner.bulk_upsert(f, records[::-1]),
+                             ids[::-1])
+
+class ReadonlyTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'test.db')
+        self.database_ref = 'sqlite:///{0}'.format(self.filename)
+
+    def tearDown(self):
+
+        ndb.get_engine(self.database_ref, readonly=True).dispose()
+        shutil.rmtree(self.directory)
+
+    def test_readonly_session_leaves_schema(self):
+
+        connection = sqlite3.connect(self.filename)
+        connection.execute('CREATE TABLE teams (id INTEGER PRIMARY KEY, '
+                           'name VARCHAR)')
+        connection.execute('PRAGMA user_version = 1')
+        connection.commit()
+
+        with ndb.db_session(self.database_ref, readonly=True) as f:
+            self.assertRaises(exc.OperationalError, f.execute,
+                              'INSERT INTO teams (name) VALUES (1)')
+
+        tables = connection.execute("SELECT name FROM sqlite_master WHERE "
+                                    "type = 'table'").fetchall()
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        connection.close()
+        self.assertEqual(tables, [(u'teams',)])
+        self.assertEqual(version, 1)
+
+class TopTest(DatabaseTest):
+
+    def test_top_runners_match_team_query(self):
+
+        with ndb.db_session(self.database_ref) as f:
+            ids = ndb.Runner.bulk_upsert(f, [('Runner {0}'.format(i),
+                                              'Villanova', 'M') for i in \
+                                             range(5)])
+            for rating, runner_id in zip([150., None, 170., 160., 140.], ids):
+                f.query(ndb.Runner).filter(ndb.Runner.id == runner_id).\
+                    update({ndb.Runner.rating: rating})
+
+        with ndb.db_session(self.database_ref, readonly=True) as f:
+            team, = ndb.Team.from_db(f, load_runners=True, top=3)
+            top = ndbfastread.top_runners(f, 3)['Villanova']
+
+            self.assertEqual([runner.id for runner in team.runners],
+                             [ids[2], ids[3], ids[0]])
+            self.assertEqual([row[0] for row in top],
+                             [runner.id for runner in team.runners])
+
+class CorrectTest(DatabaseTest):
+
+    def test_correct_unknown_runner(self):
+
+        with ndb.db_session(self.database_ref) as f:
+            runner_id, = ndb.Runner.bulk_upsert(
+                f, [('Patrick Tiernan', 'Villanova', 'M')])
+            result = ndb.Result(name='Test Invitational', date=None,
+                                distance=8000, rating=150., time='24:01.5',
+                                runner_id=runner_id)
+            f.add(result)
+            f.flush()
+
+            self.assertRaises(ndberrors.QueryError, result.correct, f,
+                              time='24:00.0', runner_id=runner_id + 1)
+            self.assertEqual(result.runner_id, runner_id)
+            self.assertEqual(result.time, '24:01.5')
+
+if __name__ == '__main__':
+    unittest.main()
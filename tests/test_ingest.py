@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import NIRCAdb as ndb
+from NIRCAdb import ingest as ndbingest
+
+################################################################################
+##
+## Headless Result Ingest
+##
+################################################################################
+
+class MatchTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.database_ref = 'sqlite:///{0}'.format(
+            os.path.join(self.directory, 'test.db'))
+        with ndb.db_session(self.database_ref) as f:
+            ndb.Team.bulk_upsert(f, [('Villanova', None)])
+            ndb.Runner.bulk_upsert(f, [('Patrick Tiernan', 'Villanova', 'M')])
+
+
+    def tearDown(self):
+
+        ndb.get_engine(self.database_ref).dispose()
+        shutil.rmtree(self.directory)
+
+    def ingest(self, name, **kwargs):
+
+        resultfile = os.path.join(self.directory, 'results.csv')
+        with open(resultfile, 'wb') as f:
+            f.write('{0},Villanova,24:01.5\n'.format(name))
+
+        ingest = ndbingest.Ingest(resultfile, 'Test Invitational', None, 8000,
+                                  'M', **kwargs)
+        with ndb.db_session(self.database_ref) as f:
+            ingest.match(f)
+            ingest.calibrate(r200=60.)
+            ingest.commit(f)
+
+        with ndb.db_session(self.database_ref, readonly=True) as f:
+            runners = [runner.name for runner in ndb.Runner.from_db(f)]
+
+        return ingest.rows[0], runners
+
+    def test_misspelled_runner_held(self):
+
+        row, runners = self.ingest('P. Tiernen')
+        self.assertEqual(row['status'], 'review')
+        self.assertEqual(row['runner_match'], 'Patrick Tiernan')
+        self.assertEqual(runners, ['Patrick Tiernan'])
+
+    def test_unmatched_runner_held(self):
+
+        row, runners = self.ingest('P. Tiernen', new_threshold=95)
+        self.assertEqual(row['status'], 'review')
+        self.assertEqual(row['reason'], 'no runner match')
+        self.assertEqual(runners, ['Patrick Tiernan'])
+
+    def test_unmatched_runner_created(self):
+
+        row, runners = self.ingest('P. Tiernen', new_threshold=95,
+                                   create_new=True)
+        self.assertEqual(row['status'], 'new')
+        self.assertEqual(sorted(runners), ['P. Tiernen', 'Patrick Tiernan'])
+
+if __name__ == '__main__':
+    unittest.main()
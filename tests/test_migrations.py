@@ -0,0 +1,53 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import NIRCAdb as ndb
+from NIRCAdb import migrations, names
+
+################################################################################
+##
+## Schema Migrations
+##
+################################################################################
+
+class NameKeyTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'test.db')
+        self.database_ref = 'sqlite:///{0}'.format(self.filename)
+
+    def tearDown(self):
+
+        ndb.get_engine(self.database_ref).dispose()
+        shutil.rmtree(self.directory)
+
+    def test_add_name_keys(self):
+
+        ## A version 6 database, before the runner name keys
+        connection = sqlite3.connect(self.filename)
+        connection.execute('CREATE TABLE runners (id INTEGER PRIMARY KEY, '
+                           'name VARCHAR)')
+        connection.executemany('INSERT INTO runners (name) VALUES (?)',
+                               [(u'Mike Smith',), (u'Michelle Smith',)])
+        connection.execute('PRAGMA user_version = 6')
+        connection.commit()
+        connection.close()
+
+        version = migrations.upgrade(ndb.get_engine(self.database_ref))
+        self.assertEqual(version, len(migrations.MIGRATIONS))
+
+        connection = sqlite3.connect(self.filename)
+        rows = connection.execute('SELECT name, name_key FROM runners').\
+               fetchall()
+        connection.close()
+        self.assertEqual([key for name, key in rows],
+                         [names.name_key(name) for name, key in rows])
+        self.assertNotEqual(rows[0][1], rows[1][1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import NIRCAdb as ndb
+from NIRCAdb import snapshot as ndbsnapshot
+
+################################################################################
+##
+## Columnar Database Snapshots
+##
+################################################################################
+
+class UpdateTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.database_ref = 'sqlite:///{0}'.format(
+            os.path.join(self.directory, 'test.db'))
+        self.snapshot = os.path.join(self.directory, 'test.snapshot')
+
+    def tearDown(self):
+
+        ndb.get_engine(self.database_ref).dispose()
+        shutil.rmtree(self.directory)
+
+    def update(self, team):
+
+        with ndb.db_session(self.database_ref) as f:
+            ndb.Team.bulk_upsert(f, [(team, None)])
+            return ndbsnapshot.Snapshot.update(f, self.snapshot)
+
+    def test_previous_version_kept(self):
+
+        self.update('Villanova')
+        snapshot = self.update('Stanford')
+        path = os.path.join(self.snapshot, 'v{0}'.format(snapshot.version))
+
+        ## Files of the previous manifest survive one update
+        self.update('Oregon')
+        self.assertTrue(os.path.isdir(path))
+        self.assertEqual(snapshot.teams['name'].tolist(),
+                         ['Villanova', 'Stanford'])
+
+        self.update('Syracuse')
+        self.assertFalse(os.path.isdir(path))
+
+if __name__ == '__main__':
+    unittest.main()